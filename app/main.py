@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 from typing import List, Optional, Dict, Any
 import logging
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime, time as time_obj
 from pydantic import BaseModel
 
@@ -12,7 +13,7 @@ from models.models import (
     TruckRoute, RouteStop, SpecialConstraint, TruckType
 )
 from utils.csv_parser import parse_stops_csv, parse_trucks_csv
-from services.routing_engine import RoutingEngine
+from services.routing_engine import RoutingEngine, shutdown_route_pool
 from app.enterprise_integrations import create_integration
 from services.natural_language import NaturalLanguageProcessor
 from services.fleet_generator import FleetGenerator
@@ -24,10 +25,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release long-lived resources when the server stops"""
+    yield
+    shutdown_route_pool()
+
+
 app = FastAPI(
     title="FlowLogic RouteAI",
     description="Autonomous AI Truck Routing System",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -111,7 +120,7 @@ async def upload_and_route(
         trucks_content = (await trucks_file.read()).decode('utf-8')
         
         # Parse CSV data
-        stops = parse_stops_csv(stops_content)
+        stops = await parse_stops_csv(stops_content)
         trucks = parse_trucks_csv(trucks_content)
         
         logger.info(f"Parsed {len(stops)} stops and {len(trucks)} trucks")
@@ -229,7 +238,7 @@ async def autonomous_routing(request: AutoRoutingRequest):
         logger.info(f"🤖 Starting autonomous routing for addresses: {request.addresses[:100]}...")
         
         # Step 1: Parse addresses using AI
-        addresses = nlp_processor.parse_address_list(request.addresses)
+        addresses = await nlp_processor.parse_address_list(request.addresses)
         logger.info(f"Parsed {len(addresses)} addresses")
         
         if not addresses:
@@ -243,8 +252,8 @@ async def autonomous_routing(request: AutoRoutingRequest):
         
         # Step 3: AI-powered stop generation
         stops = []
-        for i, address in enumerate(addresses):
-            enriched_data = nlp_processor.enrich_stop_data(address)
+        enrichments = await nlp_processor.enrich_stop_data_batch(addresses)
+        for i, (address, enriched_data) in enumerate(zip(addresses, enrichments)):
             
             # Parse time window
             time_window = enriched_data.get("suggested_time_window", "08:00-17:00")
@@ -345,7 +354,7 @@ async def live_rerouting(request: ReRoutingRequest):
         logger.info(f"🔄 Starting live re-routing: {request.reason}")
         
         # Apply changes to stops and routes with detailed tracking
-        modified_stops, affected_trucks, change_log = _apply_routing_changes(
+        modified_stops, affected_trucks, change_log = await _apply_routing_changes(
             request.stops, request.trucks, request.original_routes, request.changes
         )
         
@@ -569,8 +578,8 @@ def _generate_autonomous_insights(addresses: List[str], stops: List[Stop],
     return "\n".join(insights)
 
 
-def _apply_routing_changes(stops: List[Stop], trucks: List[Truck], 
-                         original_routes: List[TruckRoute], changes: Dict) -> tuple:
+async def _apply_routing_changes(stops: List[Stop], trucks: List[Truck], 
+                                 original_routes: List[TruckRoute], changes: Dict) -> tuple:
     """Apply dynamic changes to stops and identify affected trucks with detailed tracking"""
     modified_stops = stops.copy()
     affected_trucks = set()
@@ -599,7 +608,7 @@ def _apply_routing_changes(stops: List[Stop], trucks: List[Truck],
         
         # Use AI to enrich new stop data if minimal info provided
         if "address" in new_stop_data:
-            enriched_data = nlp_processor.enrich_stop_data(new_stop_data["address"])
+            enriched_data = (await nlp_processor.enrich_stop_data_batch([new_stop_data["address"]]))[0]
             
             # Parse time window
             time_window = new_stop_data.get("time_window", enriched_data.get("suggested_time_window", "08:00-17:00"))
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from typing import List, Optional, Dict, Any
 from datetime import datetime, time
 from enum import Enum
@@ -31,6 +31,10 @@ class Stop(BaseModel):
     latitude: Optional[float] = None
     longitude: Optional[float] = None
     service_time_minutes: int = 15  # Default 15 min per stop
+    # Matrix key and time window in minutes since midnight, filled in by the routing engine
+    _key: Optional[str] = PrivateAttr(None)
+    _tw_s: Optional[int] = PrivateAttr(None)
+    _tw_e: Optional[int] = PrivateAttr(None)
 
 
 class Truck(BaseModel):
@@ -44,6 +48,10 @@ class Truck(BaseModel):
     depot_longitude: Optional[float] = None
     cost_per_mile: float = 2.5
     avg_speed_mph: float = 45
+    # Matrix key and shift in minutes since midnight, filled in by the routing engine
+    _key: Optional[str] = PrivateAttr(None)
+    _shift_s: Optional[int] = PrivateAttr(None)
+    _shift_e: Optional[int] = PrivateAttr(None)
 
 
 class RouteStop(BaseModel):
@@ -1,16 +1,85 @@
 from typing import List, Dict, Optional, Tuple, Any
 from models.models import TruckRoute, Stop, Truck, RoutingResponse, SpecialConstraint, TruckType
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
 import os
 from dotenv import load_dotenv
 import logging
 import re
 import json
 from datetime import time, datetime
+from functools import lru_cache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Vague time phrases, in priority order (first listed wins when several match)
+_TIME_PHRASE_WINDOWS = {
+    'early morning': "06:00-09:00",
+    'morning': "08:00-12:00",
+    'lunch time': "11:30-13:30",
+    'afternoon': "13:00-17:00",
+    'evening': "17:00-20:00",
+    'business hours': "09:00-17:00",
+    'before rush hour': "08:00-16:00",
+    'after rush hour': "19:00-21:00",
+    'late delivery': "15:00-19:00",
+    'night delivery': "20:00-23:00"
+}
+_TIME_PHRASE_PRIORITY = {phrase: i for i, phrase in enumerate(_TIME_PHRASE_WINDOWS)}
+
+# Single alternation over all phrases so the instruction is scanned once
+_TIME_PHRASE_RE = re.compile(
+    '|'.join(re.escape(p) for p in sorted(_TIME_PHRASE_WINDOWS, key=len, reverse=True))
+)
+
+# Addresses per batched enrichment request, and enrichment requests in flight at once
+ENRICH_BATCH_SIZE = 20
+ENRICH_MAX_CONCURRENCY = 4
+
+_WORD_RE = re.compile(r"[a-z]+")
+_COST_RE = re.compile(r'\$(\d+(?:\.\d{2})?)')
+
+# Cost-analysis vocabulary, matched against the instruction's word set. Inflections are
+# listed explicitly; "overtime" also counts as time, as the old substring check did
+_REDUCTION_WORDS = frozenset({
+    'reduce', 'reduced', 'reduces', 'reducing', 'reduction',
+    'minimize', 'minimized', 'minimizes', 'minimizing',
+    'minimise', 'minimised', 'minimises', 'minimising',
+})
+_COST_STRATEGY_WORDS = (
+    (frozenset({'fuel'}), "fuel_optimization"),
+    (frozenset({'distance', 'distances', 'mile', 'miles', 'mileage'}), "distance_optimization"),
+    (frozenset({'time', 'times', 'overtime'}), "time_optimization"),
+    (frozenset({'overtime'}), "overtime_prevention"),
+)
+
+
+@lru_cache(maxsize=4096)
+def _rule_time(instruction_lower: str) -> Tuple[str, float, str]:
+    """Cached phrase-table lookup: (estimated_window, confidence, reasoning)"""
+    matched = [m.group(0) for m in _TIME_PHRASE_RE.finditer(instruction_lower)]
+    if matched:
+        phrase = min(matched, key=_TIME_PHRASE_PRIORITY.__getitem__)
+        return _TIME_PHRASE_WINDOWS[phrase], 0.8, f"Matched phrase: {phrase}"
+    
+    # Default business hours
+    return "09:00-17:00", 0.5, "Default business hours"
+
+
+@lru_cache(maxsize=4096)
+def _cost_keywords(instruction: str) -> Tuple[Optional[float], Tuple[str, ...]]:
+    """Cached instruction-only part of cost analysis: (target_cost, strategies)"""
+    cost_match = _COST_RE.search(instruction)
+    target_cost = float(cost_match.group(1)) if cost_match else None
+    
+    tokens = set(_WORD_RE.findall(instruction.lower()))
+    strategies = ()
+    if not tokens.isdisjoint(_REDUCTION_WORDS):
+        strategies = tuple(strategy for words, strategy in _COST_STRATEGY_WORDS if not tokens.isdisjoint(words))
+    
+    return target_cost, strategies
+
 
 class NaturalLanguageProcessor:
     """Enhanced AI-powered natural language processor for routing decisions"""
@@ -19,10 +88,13 @@ class NaturalLanguageProcessor:
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         if self.openai_api_key:
             self.client = OpenAI(api_key=self.openai_api_key)
+            # Async client for calls made from request handlers, so they don't block the event loop
+            self.async_client = AsyncOpenAI(api_key=self.openai_api_key)
             self.use_llm = True
             logger.info("OpenAI API configured for enhanced explanations")
         else:
             self.client = None
+            self.async_client = None
             self.use_llm = False
             logger.info("Using rule-based natural language generation")
         
@@ -550,16 +622,7 @@ class NaturalLanguageProcessor:
                 )
                 
                 ai_data = json.loads(response.choices[0].message.content)
-                
-                # Only use AI suggestions if confidence is high or data is missing
-                if ai_data.get("confidence", 0) > 0.7 or not existing_data:
-                    enriched_data.update({
-                        "estimated_pallets": ai_data.get("estimated_pallets", 3),
-                        "special_constraint": ai_data.get("special_constraint", "None"),
-                        "suggested_time_window": ai_data.get("suggested_time_window", "08:00-17:00"),
-                        "service_time_minutes": ai_data.get("service_time_minutes", 15),
-                        "ai_reasoning": ai_data.get("reasoning", "AI analysis")
-                    })
+                self._merge_ai_enrichment(enriched_data, ai_data, bool(existing_data))
                 
                 logger.info(f"AI enriched address '{address}': {ai_data}")
                 
@@ -569,6 +632,117 @@ class NaturalLanguageProcessor:
         # Fallback rule-based enrichment
         return self._rule_based_enrichment(address, enriched_data)
     
+    async def enrich_stop_data_batch(self, addresses: List[str]) -> List[Dict[str, Any]]:
+        """Enrich many addresses at once: one LLM request per ENRICH_BATCH_SIZE unique addresses
+        
+        Returns one enrichment dict per input address, in order. At most
+        ENRICH_MAX_CONCURRENCY requests are in flight. Addresses a batched reply left out
+        are retried on their own; a chunk whose request failed outright (transport error,
+        rate limit, unparseable reply) is not retried and gets rule-based enrichment.
+        """
+        unique = list(dict.fromkeys(addresses))
+        ai_by_address = dict.fromkeys(unique)
+        
+        if self.use_llm:
+            semaphore = asyncio.Semaphore(ENRICH_MAX_CONCURRENCY)
+            
+            async def request(chunk: List[str]) -> Optional[List[Optional[Dict[str, Any]]]]:
+                async with semaphore:
+                    return await self._ai_enrich_batch(chunk)
+            
+            chunks = [unique[start:start + ENRICH_BATCH_SIZE] for start in range(0, len(unique), ENRICH_BATCH_SIZE)]
+            missed = []
+            for chunk, items in zip(chunks, await asyncio.gather(*(request(chunk) for chunk in chunks))):
+                if items is None:
+                    continue
+                ai_by_address.update(zip(chunk, items))
+                missed.extend(a for a, ai_data in zip(chunk, items) if ai_data is None)
+            
+            retries = await asyncio.gather(*(request([a]) for a in missed))
+            ai_by_address.update((a, items[0]) for a, items in zip(missed, retries) if items is not None)
+        
+        by_address = {}
+        for address in unique:
+            enriched_data = {}
+            if ai_by_address[address] is not None:
+                self._merge_ai_enrichment(enriched_data, ai_by_address[address], False)
+            by_address[address] = self._rule_based_enrichment(address, enriched_data)
+        
+        # Repeated addresses get their own copy so callers can't alias each other's data
+        return [dict(by_address[address]) for address in addresses]
+    
+    async def _ai_enrich_batch(self, addresses: List[str]) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """One LLM request for a chunk of addresses
+        
+        Returns one entry per address, None where the reply didn't cover it, or None
+        altogether when the request itself failed.
+        """
+        try:
+            numbered = "\n".join(f'{i}. "{address}"' for i, address in enumerate(addresses))
+            prompt = f"""
+            Analyze these delivery addresses and provide logistics details for each:
+            {numbered}
+            
+            For each address, based on its type, estimate:
+            1. Likely pallet count (1-20, default 3)
+            2. Special handling requirements (Fragile, Refrigerated, Frozen, Hazmat, Heavy, None; default None)
+            3. Suggested delivery time window (default 08:00-17:00)
+            4. Expected service time in minutes (10-30, default 15)
+            
+            Address types to consider:
+            - Residential: 1-3 pallets, fragile items, flexible windows
+            - Retail stores: 3-8 pallets, mixed goods, business hours
+            - Restaurants: 2-6 pallets, refrigerated/frozen, morning preferred
+            - Warehouses: 5-20 pallets, heavy items, all day
+            - Hospitals: 1-5 pallets, fragile/medical, specific windows
+            
+            Return a JSON array with one object per address, in the same order:
+            [{{
+                "index": integer,
+                "estimated_pallets": integer,
+                "special_constraint": "None|Fragile|Refrigerated|Frozen|Hazmat|Heavy",
+                "suggested_time_window": "HH:MM-HH:MM",
+                "service_time_minutes": integer,
+                "confidence": float (0.0-1.0),
+                "reasoning": "brief explanation"
+            }}]
+            """
+            
+            response = await self.async_client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "You are a logistics AI that analyzes delivery addresses."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=120 * len(addresses) + 100,
+                temperature=0.3
+            )
+            
+            items = json.loads(response.choices[0].message.content)
+            results = [None] * len(addresses)
+            for pos, item in enumerate(items):
+                idx = item.get("index", pos)
+                if isinstance(idx, int) and 0 <= idx < len(addresses):
+                    results[idx] = item
+            logger.info(f"AI enriched {sum(r is not None for r in results)}/{len(addresses)} addresses in one request")
+            return results
+            
+        except Exception as e:
+            logger.error(f"Batched AI enrichment failed for {len(addresses)} addresses: {e}")
+            return None
+    
+    def _merge_ai_enrichment(self, enriched_data: Dict[str, Any], ai_data: Dict[str, Any],
+                             has_existing: bool) -> None:
+        """Copy AI suggestions into enriched_data if confidence is high or data is missing"""
+        if ai_data.get("confidence", 0) > 0.7 or not has_existing:
+            enriched_data.update({
+                "estimated_pallets": ai_data.get("estimated_pallets", 3),
+                "special_constraint": ai_data.get("special_constraint", "None"),
+                "suggested_time_window": ai_data.get("suggested_time_window", "08:00-17:00"),
+                "service_time_minutes": ai_data.get("service_time_minutes", 15),
+                "ai_reasoning": ai_data.get("reasoning", "AI analysis")
+            })
+    
     def _rule_based_enrichment(self, address: str, existing_data: Dict[str, Any]) -> Dict[str, Any]:
         """Rule-based fallback for data enrichment"""
         address_lower = address.lower()
@@ -609,14 +783,14 @@ class NaturalLanguageProcessor:
         
         return existing_data
     
-    def parse_address_list(self, address_text: str) -> List[str]:
+    async def parse_address_list(self, address_text: str) -> List[str]:
         """Parse free-form address text into individual addresses"""
         if self.use_llm:
-            return self._ai_parse_addresses(address_text)
+            return await self._ai_parse_addresses(address_text)
         else:
             return self._regex_parse_addresses(address_text)
     
-    def _ai_parse_addresses(self, address_text: str) -> List[str]:
+    async def _ai_parse_addresses(self, address_text: str) -> List[str]:
         """Use AI to parse complex address lists"""
         try:
             prompt = f"""
@@ -635,7 +809,7 @@ class NaturalLanguageProcessor:
             ["address1", "address2", ...]
             """
             
-            response = self.client.chat.completions.create(
+            response = await self.async_client.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "You are an address parsing AI. Return only valid JSON."},
@@ -666,14 +840,15 @@ class NaturalLanguageProcessor:
         
         return addresses if addresses else [address_text.strip()]
     
-    def estimate_time_windows_from_vague_phrases(self, instruction: str) -> Dict[str, str]:
+    async def estimate_time_windows_from_vague_phrases(self, instruction: str) -> Dict[str, str]:
         """Estimate time windows from vague phrases"""
-        if self.use_llm:
-            return self._ai_estimate_time_windows(instruction)
-        else:
-            return self._rule_based_time_estimation(instruction)
+        # Known phrases are answered by the rule table without an API round-trip
+        result = self._rule_based_time_estimation(instruction)
+        if result["confidence"] >= 0.8 or not self.use_llm:
+            return result
+        return await self._ai_estimate_time_windows(instruction)
     
-    def _ai_estimate_time_windows(self, instruction: str) -> Dict[str, str]:
+    async def _ai_estimate_time_windows(self, instruction: str) -> Dict[str, str]:
         """Use AI to estimate time windows from vague descriptions"""
         try:
             prompt = f"""
@@ -694,19 +869,18 @@ class NaturalLanguageProcessor:
             {{
                 "estimated_window": "HH:MM-HH:MM",
                 "confidence": float (0.0-1.0),
-                "reasoning": "brief explanation"
+                "reasoning": "explanation in under 10 words"
             }}
-            
-            Only return valid JSON:
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            response = await self.async_client.chat.completions.create(
+                model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "You are a time window estimation AI."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=150,
+                response_format={"type": "json_object"},
+                max_tokens=60,
                 temperature=0.2
             )
             
@@ -720,46 +894,20 @@ class NaturalLanguageProcessor:
     
     def _rule_based_time_estimation(self, instruction: str) -> Dict[str, str]:
         """Rule-based time window estimation"""
-        instruction_lower = instruction.lower()
-        
-        # Time phrase mappings
-        time_mappings = {
-            'early morning': "06:00-09:00",
-            'morning': "08:00-12:00", 
-            'lunch time': "11:30-13:30",
-            'afternoon': "13:00-17:00",
-            'evening': "17:00-20:00",
-            'business hours': "09:00-17:00",
-            'before rush hour': "08:00-16:00",
-            'after rush hour': "19:00-21:00",
-            'late delivery': "15:00-19:00",
-            'night delivery': "20:00-23:00"
-        }
-        
-        for phrase, window in time_mappings.items():
-            if phrase in instruction_lower:
-                return {
-                    "estimated_window": window,
-                    "confidence": 0.8,
-                    "reasoning": f"Matched phrase: {phrase}"
-                }
-        
-        # Default business hours
+        window, confidence, reasoning = _rule_time(instruction.lower())
         return {
-            "estimated_window": "09:00-17:00",
-            "confidence": 0.5,
-            "reasoning": "Default business hours"
+            "estimated_window": window,
+            "confidence": confidence,
+            "reasoning": reasoning
         }
     
     def analyze_cost_targets(self, instruction: str, current_routes: List[TruckRoute] = None) -> Dict[str, Any]:
         """Analyze cost optimization targets from natural language"""
-        instruction_lower = instruction.lower()
+        target_cost, strategies = _cost_keywords(instruction)
         analysis = {}
         
         # Extract cost targets
-        cost_match = re.search(r'\$(\d+(?:\.\d{2})?)', instruction)
-        if cost_match:
-            target_cost = float(cost_match.group(1))
+        if target_cost is not None:
             analysis["target_cost"] = target_cost
             
             if current_routes:
@@ -770,18 +918,7 @@ class NaturalLanguageProcessor:
                 analysis["reduction_percentage"] = (savings_needed / current_cost) * 100 if current_cost > 0 else 0
         
         # Identify cost reduction strategies
-        strategies = []
-        if 'reduce' in instruction_lower or 'minimize' in instruction_lower:
-            if 'fuel' in instruction_lower:
-                strategies.append("fuel_optimization")
-            if 'distance' in instruction_lower or 'miles' in instruction_lower:
-                strategies.append("distance_optimization")
-            if 'time' in instruction_lower:
-                strategies.append("time_optimization")
-            if 'overtime' in instruction_lower:
-                strategies.append("overtime_prevention")
-        
         if strategies:
-            analysis["strategies"] = strategies
+            analysis["strategies"] = list(strategies)
         
         return analysis
\ No newline at end of file
@@ -1,34 +1,136 @@
+import gzip
 import httpx
+import numpy as np
+import orjson
 import os
 from typing import List, Dict, Optional, Tuple
 from models.models import Stop, Truck
+from utils.geocoding import EARTH_RADIUS_MILES
 import logging
 from dotenv import load_dotenv
 import asyncio
+from math import cos, sin, asin, sqrt
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is an optional accelerator
+    njit = None
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Up to this many stops the fallback precomputes the full distance matrix;
+# above it the O(n^2) matrix is skipped and nearest neighbors come from a BallTree
+BALLTREE_MIN_STOPS = 1000
+BALLTREE_K = 8
+
+METERS_PER_MILE = 1609.34
+_STOP_ID_PREFIX = "stop_"
+_STOP_ID_OFFSET = len(_STOP_ID_PREFIX)
+
+# Request bodies smaller than this are sent uncompressed
+GZIP_MIN_BYTES = 1024
+
+
+def _haversine_matrix_np(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """All-pairs haversine distance matrix in miles (inputs in radians)"""
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    cos_lat = np.cos(lat)
+    a = np.sin(dlat / 2) ** 2 + cos_lat[:, None] * cos_lat[None, :] * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_MILES * 2 * np.arcsin(np.sqrt(a))
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def haversine_matrix(lat, lon):
+        """All-pairs haversine distance matrix in miles (inputs in radians), rows in parallel"""
+        n = lat.shape[0]
+        D = np.empty((n, n))
+        for i in prange(n):
+            ci = cos(lat[i])
+            for j in range(n):
+                a = sin((lat[j] - lat[i]) / 2) ** 2 + ci * cos(lat[j]) * sin((lon[j] - lon[i]) / 2) ** 2
+                D[i, j] = 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
+        return D
+else:
+    haversine_matrix = _haversine_matrix_np
+
+
+def _hav_vec(lat1: float, lon1: float, lats: np.ndarray, lons: np.ndarray,
+             cos_lats: Optional[np.ndarray] = None) -> np.ndarray:
+    """Haversine distance in miles from one point to many (all in radians)
+
+    Pass ``cos_lats`` (``np.cos(lats)``) when calling repeatedly over the same points.
+    """
+    if cos_lats is None:
+        cos_lats = np.cos(lats)
+    dlat = lats - lat1
+    dlon = lons - lon1
+    a = np.sin(dlat / 2) ** 2 + cos(lat1) * cos_lats * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_MILES * 2 * np.arcsin(np.sqrt(a))
+
 
 class RouteOptimizer:
-    """Service for getting optimized routes using external APIs"""
+    """Service for getting optimized routes using external APIs
+    
+    Holds a pooled HTTP client when GraphHopper is configured; use it as
+    ``async with RouteOptimizer() as optimizer:`` or await ``close()`` when done.
+    """
     
     def __init__(self):
         self.graphhopper_api_key = os.getenv("GRAPHHOPPER_API_KEY")
         self.use_graphhopper = bool(self.graphhopper_api_key)
+        self.graphhopper_deadline = float(os.getenv("GRAPHHOPPER_DEADLINE_SECONDS", "3.0"))
+        self.gzip_requests = os.getenv("GRAPHHOPPER_GZIP_REQUESTS", "true").lower() == "true"
+        self._client: Optional[httpx.AsyncClient] = None
         
         if self.use_graphhopper:
+            # Shared client keeps connections to GraphHopper alive across requests
+            self._client = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                headers={
+                    "Authorization": f"Bearer {self.graphhopper_api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
             logger.info("Using GraphHopper for route optimization")
         else:
             logger.info("GraphHopper API key not found, using fallback routing")
     
+    async def close(self):
+        """Release pooled HTTP connections (call on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def __aenter__(self) -> "RouteOptimizer":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
     async def get_optimized_route(self, depot: Tuple[float, float], 
                                  stops: List[Tuple[float, float]]) -> Optional[Dict]:
         """Get optimized route from GraphHopper or fallback"""
-        if self.use_graphhopper:
-            return await self._graphhopper_route(depot, stops)
-        else:
+        if not self.use_graphhopper:
             return self._fallback_route(depot, stops)
+        
+        # Race the API against the local fallback; ship the fallback if the API misses the deadline
+        gh_task = asyncio.create_task(self._graphhopper_route(depot, stops))
+        fallback = self._fallback_route(depot, stops)
+        done, _ = await asyncio.wait({gh_task}, timeout=self.graphhopper_deadline)
+        
+        if gh_task in done:
+            result = gh_task.result()
+            if result is not None:
+                return result
+        else:
+            gh_task.cancel()
+            logger.warning(f"GraphHopper missed {self.graphhopper_deadline}s deadline, using fallback routing")
+        
+        return fallback
     
     async def _graphhopper_route(self, depot: Tuple[float, float], 
                                stops: List[Tuple[float, float]]) -> Optional[Dict]:
@@ -50,7 +152,7 @@ class RouteOptimizer:
             services = []
             for i, (lat, lon) in enumerate(stops):
                 services.append({
-                    "id": f"stop_{i}",
+                    "id": f"{_STOP_ID_PREFIX}{i}",
                     "address": {
                         "location_id": f"loc_{i}",
                         "lon": lon,
@@ -68,20 +170,20 @@ class RouteOptimizer:
                 }]
             }
             
-            headers = {
-                "Authorization": f"Bearer {self.graphhopper_api_key}",
-                "Content-Type": "application/json"
-            }
+            body = orjson.dumps(problem)
+            headers = {}
+            if self.gzip_requests and len(body) >= GZIP_MIN_BYTES:
+                body = gzip.compress(body)
+                headers["Content-Encoding"] = "gzip"
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, json=problem, headers=headers, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return self._parse_graphhopper_response(result)
-                else:
-                    logger.error(f"GraphHopper API error: {response.status_code}")
-                    return self._fallback_route(depot, stops)
+            response = await self._client.post(url, content=body, headers=headers)
+            
+            if response.status_code == 200:
+                result = orjson.loads(response.content)
+                return self._parse_graphhopper_response(result)
+            else:
+                logger.error(f"GraphHopper API error: {response.status_code}")
+                return self._fallback_route(depot, stops)
                     
         except Exception as e:
             logger.error(f"GraphHopper routing failed: {e}")
@@ -100,8 +202,8 @@ class RouteOptimizer:
                 
                 for activity in activities:
                     if activity["type"] == "service":
-                        stop_id = int(activity["id"].split("_")[1])
-                        distance = activity.get("distance", 0) / 1609.34  # meters to miles
+                        stop_id = int(activity["id"][_STOP_ID_OFFSET:])
+                        distance = activity.get("distance", 0) / METERS_PER_MILE
                         stop_sequence.append({
                             "stop_index": stop_id,
                             "distance": distance
@@ -128,32 +230,20 @@ class RouteOptimizer:
                 "optimized": False
             }
         
-        # Nearest neighbor algorithm
-        unvisited = list(range(len(stops)))
-        current_pos = depot
-        sequence = []
-        total_distance = 0
+        # Nearest neighbor algorithm over radian coordinates (row 0 is the depot)
+        pts = np.radians(np.array([depot, *stops], dtype=np.float64))
+        if len(stops) > BALLTREE_MIN_STOPS:
+            order, legs, return_dist = self._balltree_order(pts)
+        else:
+            order, legs, return_dist = self._nearest_neighbor_order(pts)
         
-        while unvisited:
-            nearest_idx = None
-            nearest_dist = float('inf')
-            
-            for idx in unvisited:
-                dist = self._haversine_distance(current_pos, stops[idx])
-                if dist < nearest_dist:
-                    nearest_dist = dist
-                    nearest_idx = idx
-            
-            sequence.append({
-                "stop_index": nearest_idx,
-                "distance": nearest_dist
-            })
-            total_distance += nearest_dist
-            current_pos = stops[nearest_idx]
-            unvisited.remove(nearest_idx)
+        sequence = [
+            {"stop_index": idx, "distance": dist}
+            for idx, dist in zip(order, legs)
+        ]
+        total_distance = sum(legs)
         
         # Add return to depot
-        return_dist = self._haversine_distance(current_pos, depot)
         total_distance += return_dist
         
         return {
@@ -162,23 +252,62 @@ class RouteOptimizer:
             "optimized": False
         }
     
-    def _haversine_distance(self, coord1: Tuple[float, float], 
-                           coord2: Tuple[float, float]) -> float:
-        """Calculate distance in miles between two coordinates"""
-        from math import radians, cos, sin, asin, sqrt
+    def _nearest_neighbor_order(self, pts: np.ndarray) -> Tuple[List[int], List[float], float]:
+        """Nearest neighbor order, leg distances and return leg over radian points (row 0 = depot)
+
+        Uses a precomputed distance matrix.
+        """
+        D = haversine_matrix(np.ascontiguousarray(pts[:, 0]), np.ascontiguousarray(pts[:, 1]))
+        to_stop = D[:, 1:]  # view: distances from each point to each stop
+        remaining = to_stop.shape[1]
+        cur = 0
+        order, legs = [], []
         
-        lat1, lon1 = coord1
-        lat2, lon2 = coord2
+        while remaining:
+            row = to_stop[cur]
+            nearest_idx = int(row.argmin())
+            order.append(nearest_idx)
+            legs.append(float(row[nearest_idx]))
+            # Masking the stop's column marks it visited; argmin never picks it again
+            to_stop[:, nearest_idx] = np.inf
+            remaining -= 1
+            cur = nearest_idx + 1
         
-        # Convert to radians
-        lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+        # Depot column is never masked, so the return leg is a lookup
+        return order, legs, float(D[cur, 0])
+    
+    def _balltree_order(self, pts: np.ndarray) -> Tuple[List[int], List[float], float]:
+        """Nearest neighbor order, leg distances and return leg using a haversine BallTree"""
+        stop_pts = pts[1:]
+        n = len(stop_pts)
+        from sklearn.neighbors import BallTree  # slow import, only needed for very large inputs
+        tree = BallTree(stop_pts, metric='haversine')
+        cos_lats = np.cos(stop_pts[:, 0])
+        depot_dists = _hav_vec(pts[0, 0], pts[0, 1], stop_pts[:, 0], stop_pts[:, 1], cos_lats)
+        visited = np.zeros(n, dtype=bool)
+        current = pts[0]
+        order, legs = [], []
         
-        # Haversine formula
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
+        for _ in range(n):
+            dist, ind = tree.query(current.reshape(1, -1), k=min(BALLTREE_K, n))
+            nearest_idx = None
+            for d, i in zip(dist[0], ind[0]):
+                if not visited[i]:
+                    nearest_idx, nearest_dist = int(i), float(d) * EARTH_RADIUS_MILES
+                    break
+            
+            if nearest_idx is None:
+                # All k neighbours already visited: masked brute-force search
+                unvisited_indices = np.flatnonzero(~visited)
+                dists = _hav_vec(current[0], current[1],
+                                 stop_pts[unvisited_indices, 0], stop_pts[unvisited_indices, 1],
+                                 cos_lats[unvisited_indices])
+                best = int(dists.argmin())
+                nearest_idx, nearest_dist = int(unvisited_indices[best]), float(dists[best])
+            
+            order.append(nearest_idx)
+            legs.append(nearest_dist)
+            visited[nearest_idx] = True
+            current = stop_pts[nearest_idx]
         
-        # Radius of Earth in miles
-        r = 3959
-        return c * r
\ No newline at end of file
+        return order, legs, float(depot_dists[order[-1]])
@@ -1,15 +1,297 @@
 from typing import List, Dict, Tuple, Optional, Set
 from datetime import datetime, timedelta, time
 from models.models import Stop, Truck, TruckRoute, RouteStop, SpecialConstraint, TruckType
-from utils.geocoding import GeocodingService
+from utils.geocoding import EARTH_RADIUS_MILES, get_geocoding_service
 import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
+try:
+    from numba import njit
+except ImportError:  # numba is an optional accelerator
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_DISTANCE_MILES = 50  # Used when a location could not be geocoded
+# Distance matrices kept for re-routing the same locations, bounded by total size;
+# a single matrix above the budget (about 8k locations) is never cached
+MATRIX_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Independent trucks can be solved side by side in a process pool. Off by default: pool
+# round trips only pay off for waves with enough stops to keep OR-Tools busy
+PARALLEL_ROUTING = os.getenv("PARALLEL_ROUTING", "false").lower() == "true"
+ROUTE_WORKERS = int(os.getenv("ROUTE_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_STOPS = 60  # stops across a wave's solver-bound trucks before it is sent to the pool
+
+# OR-Tools search budget scales with route size: 50 ms per stop, clamped to 0.1-5 s
+SOLVER_MS_PER_STOP = 50
+SOLVER_MIN_MS = 100
+SOLVER_MAX_MS = 5000
+SOLVER_SOLUTION_LIMIT = 100
+EXACT_MAX_STOPS = 8  # at or below this, search every visiting order instead of calling OR-Tools
+MAX_WAIT_MINUTES = 30  # waiting allowed before each stop's window opens
+DAY_MINUTES = 24 * 60
+
+# One bit per special constraint so compatibility is a single AND
+_CONSTRAINT_BITS = {constraint: 1 << i for i, constraint in enumerate(SpecialConstraint)}
+
+
+def _greedy_core_np(dist: np.ndarray, pallets: np.ndarray, tw_end: np.ndarray, service: np.ndarray,
+                    max_pallets: int, shift_start: int, speed_mph: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Nearest-feasible-stop sequence for one truck.
+    
+    ``dist`` is the truck's node matrix (node 0 = depot, node k = stop k - 1); the other
+    arrays are per stop, with time windows in minutes since midnight. Returns the stop
+    positions in visiting order and their arrival minutes.
+    """
+    n = len(pallets)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    arrivals = np.empty(n, dtype=np.int64)
+    k = 0
+    cur = 0
+    current_time = shift_start
+    total_pallets = 0
+    
+    while k < n and total_pallets < max_pallets:
+        # Find nearest feasible stop: unvisited, fits remaining capacity and arrives before window closes
+        distances = dist[cur, 1:]
+        feasible = (~visited
+                    & (total_pallets + pallets <= max_pallets)
+                    & (current_time + distances * 60 / speed_mph <= tw_end))
+        
+        if not feasible.any():
+            break
+        
+        best = int(np.argmin(np.where(feasible, distances, np.inf)))
+        arrival_mins = current_time + int(distances[best] * 60 / speed_mph)
+        
+        order[k] = best
+        arrivals[k] = arrival_mins
+        k += 1
+        visited[best] = True
+        total_pallets += pallets[best]
+        current_time = arrival_mins + service[best]
+        cur = best + 1
+    
+    return order[:k], arrivals[:k]
+
+
+def _greedy_core_loops(dist, pallets, tw_end, service, max_pallets, shift_start, speed_mph):
+    """Scalar-loop form of ``_greedy_core_np`` for Numba compilation"""
+    n = pallets.shape[0]
+    order = np.empty(n, dtype=np.int64)
+    arrivals = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=np.bool_)
+    cur = 0
+    current_time = shift_start
+    total_pallets = 0
+    k = 0
+    
+    while k < n and total_pallets < max_pallets:
+        best = -1
+        best_distance = np.inf
+        for i in range(n):
+            if visited[i] or total_pallets + pallets[i] > max_pallets:
+                continue
+            d = dist[cur, i + 1]
+            if current_time + d * 60 / speed_mph <= tw_end[i] and d < best_distance:
+                best = i
+                best_distance = d
+        
+        if best < 0:
+            break
+        
+        arrival_mins = current_time + int(best_distance * 60 / speed_mph)
+        order[k] = best
+        arrivals[k] = arrival_mins
+        k += 1
+        visited[best] = True
+        total_pallets += pallets[best]
+        current_time = arrival_mins + service[best]
+        cur = best + 1
+    
+    return order[:k], arrivals[:k]
+
+
+if njit is not None:
+    _greedy_core = njit(cache=True)(_greedy_core_loops)
+else:
+    _greedy_core = _greedy_core_np
+
+
+def _exact_route_order(cost: List[List[int]], transit: List[List[int]],
+                       tw_s: List[int], tw_e: List[int]) -> Optional[List[int]]:
+    """Cheapest visiting order of every stop that respects the time windows.
+    
+    Same model as the OR-Tools time dimension: ``transit[i][j]`` is travel plus service
+    time at ``j``, up to MAX_WAIT_MINUTES of waiting per arc, free start time within the
+    day. Depth-first over all orders, pruned on cost and on the feasible arrival range.
+    Returns routing nodes (stop k - 1 is node k), or None when no order is feasible.
+    """
+    n = len(tw_s)
+    # Expanding nearest stops first finds cheap orders early, which tightens the pruning
+    nearest = [sorted(range(1, n + 1), key=row.__getitem__) for row in cost]
+    visited = [False] * (n + 1)
+    path = []
+    best_cost = float("inf")
+    best_path = None
+    
+    def visit(node: int, lo: int, hi: int, so_far: int):
+        nonlocal best_cost, best_path
+        if len(path) == n:
+            total = so_far + cost[node][0]
+            if total < best_cost and lo + transit[node][0] <= DAY_MINUTES:
+                best_cost, best_path = total, path.copy()
+            return
+        
+        for nxt in nearest[node]:
+            if visited[nxt]:
+                continue
+            if so_far + cost[node][nxt] >= best_cost:
+                break  # remaining candidates are further away
+            # Arrival range at nxt given the range at node, clipped to its window
+            t = transit[node][nxt]
+            nxt_lo = max(lo + t, tw_s[nxt - 1])
+            nxt_hi = min(hi + t + MAX_WAIT_MINUTES, tw_e[nxt - 1])
+            if nxt_lo > nxt_hi:
+                continue
+            visited[nxt] = True
+            path.append(nxt)
+            visit(nxt, nxt_lo, nxt_hi, so_far + cost[node][nxt])
+            path.pop()
+            visited[nxt] = False
+    
+    visit(0, 0, DAY_MINUTES, 0)
+    return best_path
+
+
+_route_pool: Optional[ProcessPoolExecutor] = None
+_route_pool_lock = threading.Lock()
+
+
+def _init_route_worker():
+    """Pool worker start-up: Ctrl-C is handled by the parent, which shuts the pool down"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _get_route_pool() -> ProcessPoolExecutor:
+    """Long-lived solver pool, started on first use
+    
+    Workers are spawned rather than forked: the server process already runs threads
+    and holds open clients and the geocode cache connection, none of which survive a fork.
+    """
+    global _route_pool
+    with _route_pool_lock:
+        if _route_pool is None:
+            _route_pool = ProcessPoolExecutor(
+                max_workers=ROUTE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_route_worker
+            )
+        return _route_pool
+
+
+def shutdown_route_pool():
+    """Stop the solver pool (call on application shutdown)"""
+    global _route_pool
+    with _route_pool_lock:
+        if _route_pool is not None:
+            _route_pool.shutdown()
+            _route_pool = None
+
+
+def _solve_node_order(matrix_np: np.ndarray, arrays: "StopArrays", max_pallets: int,
+                      avg_speed_mph: float, first_solution_strategy: int) -> Optional[List[int]]:
+    """Visiting order of routing nodes for one truck, or None when no feasible order was found
+    
+    ``matrix_np`` is the truck's node matrix in hundredths of a mile (node 0 is the depot,
+    node k is stop k - 1) and ``arrays`` holds the stops' attributes. Takes only arrays and
+    scalars, so it can run in a pool worker.
+    """
+    n_stops = len(arrays.pallets)
+    matrix = matrix_np.tolist()
+    
+    # Travel time between nodes plus service time at the destination (none at the depot)
+    time_per_mile = 60 / avg_speed_mph  # minutes per mile
+    service_times = np.concatenate(([0], arrays.service))
+    time_matrix = ((matrix_np * time_per_mile / 100).astype(np.int64) + service_times[None, :]).tolist()
+    
+    # Small routes: trying every order is exact and cheaper than building the solver model
+    if n_stops <= EXACT_MAX_STOPS:
+        if arrays.pallets.sum() > max_pallets:
+            return None
+        return _exact_route_order(matrix, time_matrix, arrays.tw_s.tolist(), arrays.tw_e.tolist())
+    
+    # Create routing model
+    manager = pywrapcp.RoutingIndexManager(n_stops + 1, 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+    
+    # Hand the solver precomputed matrices so arc evaluation stays inside the C++ core
+    transit_callback_index = routing.RegisterTransitMatrix(matrix)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    
+    # Add capacity constraint
+    demand_callback_index = routing.RegisterUnaryTransitVector([0] + arrays.pallets.tolist())
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index,
+        0,  # null capacity slack
+        [max_pallets],  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Capacity')
+    
+    # Add time window constraints
+    time_dimension_name = 'Time'
+    time_callback_index = routing.RegisterTransitMatrix(time_matrix)
+    
+    # Set time windows
+    time_windows = [(0, DAY_MINUTES)]  # Depot open all day
+    time_windows.extend(zip(arrays.tw_s.tolist(), arrays.tw_e.tolist()))
+    
+    routing.AddDimension(
+        time_callback_index,
+        MAX_WAIT_MINUTES,  # allow waiting time
+        DAY_MINUTES,  # maximum time per vehicle
+        False,  # Don't force start cumul to zero
+        time_dimension_name)
+    
+    time_dimension = routing.GetDimensionOrDie(time_dimension_name)
+    for location_idx, time_window in enumerate(time_windows):
+        index = manager.NodeToIndex(location_idx)
+        time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
+    
+    # Solve
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = first_solution_strategy
+    # Routes that reach the solver have more than EXACT_MAX_STOPS stops, so always use GLS
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.time_limit.FromMilliseconds(
+        max(SOLVER_MIN_MS, min(SOLVER_MAX_MS, SOLVER_MS_PER_STOP * n_stops)))
+    search_parameters.solution_limit = SOLVER_SOLUTION_LIMIT
+    search_parameters.lns_time_limit.FromMilliseconds(max(50, 10 * n_stops))
+    search_parameters.log_search = False
+    
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None
+    
+    sequence = []
+    index = solution.Value(routing.NextVar(routing.Start(0)))
+    while not routing.IsEnd(index):
+        sequence.append(manager.IndexToNode(index))
+        index = solution.Value(routing.NextVar(index))
+    return sequence
+
 
 @dataclass
 class RouteSegment:
@@ -19,16 +301,58 @@ class RouteSegment:
     travel_time_minutes: float
 
 
+@dataclass
+class StopArrays:
+    """Per-stop routing attributes as parallel arrays, one row per stop"""
+    constraint_bits: np.ndarray
+    pallets: np.ndarray
+    service: np.ndarray
+    tw_s: np.ndarray  # window start, minutes since midnight
+    tw_e: np.ndarray  # window end, minutes since midnight
+    
+    @classmethod
+    def from_stops(cls, stops: List[Stop]) -> "StopArrays":
+        return cls(
+            constraint_bits=np.fromiter((_CONSTRAINT_BITS[s.special_constraint] for s in stops), dtype=np.int64, count=len(stops)),
+            pallets=np.fromiter((s.pallets for s in stops), dtype=np.int64, count=len(stops)),
+            service=np.fromiter((s.service_time_minutes for s in stops), dtype=np.int64, count=len(stops)),
+            tw_s=np.fromiter((s._tw_s for s in stops), dtype=np.int64, count=len(stops)),
+            tw_e=np.fromiter((s._tw_e for s in stops), dtype=np.int64, count=len(stops))
+        )
+    
+    def take(self, rows: List[int]) -> "StopArrays":
+        """Arrays for a subset of stops, in the given row order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return StopArrays(self.constraint_bits[rows], self.pallets[rows], self.service[rows],
+                          self.tw_s[rows], self.tw_e[rows])
+
+
 class RoutingEngine:
     def __init__(self):
-        self.geocoding_service = GeocodingService()
+        self.geocoding_service = get_geocoding_service()
         self.compatibility_rules = {
-            TruckType.DRY: [SpecialConstraint.NONE, SpecialConstraint.FRAGILE, SpecialConstraint.HEAVY],
-            TruckType.REFRIGERATED: [SpecialConstraint.NONE, SpecialConstraint.REFRIGERATED, SpecialConstraint.FRAGILE],
-            TruckType.FROZEN: [SpecialConstraint.NONE, SpecialConstraint.FROZEN, SpecialConstraint.REFRIGERATED],
-            TruckType.HAZMAT: [SpecialConstraint.HAZMAT],
-            TruckType.FLATBED: [SpecialConstraint.HEAVY, SpecialConstraint.NONE]
+            TruckType.DRY: frozenset([SpecialConstraint.NONE, SpecialConstraint.FRAGILE, SpecialConstraint.HEAVY]),
+            TruckType.REFRIGERATED: frozenset([SpecialConstraint.NONE, SpecialConstraint.REFRIGERATED, SpecialConstraint.FRAGILE]),
+            TruckType.FROZEN: frozenset([SpecialConstraint.NONE, SpecialConstraint.FROZEN, SpecialConstraint.REFRIGERATED]),
+            TruckType.HAZMAT: frozenset([SpecialConstraint.HAZMAT]),
+            TruckType.FLATBED: frozenset([SpecialConstraint.HEAVY, SpecialConstraint.NONE])
+        }
+        self._truck_masks = {
+            truck_type: sum(_CONSTRAINT_BITS[c] for c in constraints)
+            for truck_type, constraints in self.compatibility_rules.items()
         }
+        # Handling note per special constraint (fragile is only noted for the first stop)
+        self._note_templates = {
+            SpecialConstraint.REFRIGERATED: "Temperature-controlled delivery",
+            SpecialConstraint.FROZEN: "Frozen goods - maintain cold chain",
+            SpecialConstraint.HAZMAT: "Hazmat - follow safety protocols"
+        }
+        # Construction heuristic for OR-Tools; insertion suits time-windowed routes better than cheapest arc
+        self.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+        # frozenset of rounded (lat, lon) -> (coordinate list, distance matrix), LRU ordered
+        self._matrix_cache: "OrderedDict[frozenset, Tuple[List[Tuple[float, float]], np.ndarray]]" = OrderedDict()
+        self._matrix_cache_bytes = 0
+        self._matrix_cache_lock = threading.Lock()
     
     def route_trucks(self, stops: List[Stop], trucks: List[Truck]) -> Dict[str, TruckRoute]:
         """Main routing algorithm"""
@@ -36,39 +360,99 @@ class RoutingEngine:
         
         # Step 1: Geocode all addresses
         self._geocode_locations(stops, trucks)
+        self._prepare_models(stops, trucks)
         
         # Step 2: Create distance matrix
-        distance_matrix = self._create_full_distance_matrix(stops, trucks)
+        dist_np, dist_i64, idx_map = self._create_full_distance_matrix(stops, trucks)
+        
+        # Per-stop attributes as arrays; Stop objects are only read again when emitting routes
+        stop_arrays = StopArrays.from_stops(stops)
+        stop_rows = {s.stop_id: i for i, s in enumerate(stops)}
         
         # Step 3: Filter compatible stops for each truck
-        truck_compatible_stops = self._get_compatible_stops(trucks, stops)
+        truck_compatible_stops = self._get_compatible_stops(trucks, stops, stop_arrays)
         
-        # Step 4: Run optimization for each truck
+        # Step 4: Run optimization for each truck, largest first, solving independent trucks in parallel
+        truck_order = sorted(trucks, key=lambda t: t.max_pallets, reverse=True)
         truck_routes = {}
         assigned_stops = set()
+        pending = truck_order
         
-        for truck in sorted(trucks, key=lambda t: t.max_pallets, reverse=True):
-            available_stops = [s for s in truck_compatible_stops[truck.truck_id] 
-                             if s.stop_id not in assigned_stops]
+        while pending:
+            wave, pending = self._plan_wave(pending, truck_compatible_stops, assigned_stops)
+            solved = [t for t, available_stops in wave if available_stops]
             
-            if not available_stops:
-                truck_routes[truck.truck_id] = self._create_empty_route(truck)
-                continue
+            for truck, available_stops in wave:
+                if not available_stops:
+                    truck_routes[truck.truck_id] = self._create_empty_route(truck)
             
-            route = self._optimize_truck_route(truck, available_stops, distance_matrix)
-            truck_routes[truck.truck_id] = route
+            # Only OR-Tools solves are worth shipping to another process
+            heavy = [(t, s) for t, s in wave if len(s) > EXACT_MAX_STOPS]
+            if (PARALLEL_ROUTING and ROUTE_WORKERS > 1 and len(heavy) > 1
+                    and sum(len(s) for _, s in heavy) >= PARALLEL_MIN_STOPS):
+                pool = _get_route_pool()
+                futures = {}
+                for truck, available_stops in heavy:
+                    loc_idx = self._route_node_index(truck, available_stops, idx_map)
+                    arrays = stop_arrays.take([stop_rows[s.stop_id] for s in available_stops])
+                    futures[truck.truck_id] = (loc_idx, arrays, pool.submit(
+                        _solve_node_order, np.ascontiguousarray(dist_i64[np.ix_(loc_idx, loc_idx)]),
+                        arrays, truck.max_pallets, truck.avg_speed_mph, self.first_solution_strategy
+                    ))
+                for truck, available_stops in heavy:
+                    loc_idx, arrays, future = futures[truck.truck_id]
+                    truck_routes[truck.truck_id] = self._route_for_sequence(
+                        truck, available_stops, future.result(), dist_np, loc_idx, arrays)
             
-            for stop in route.stops:
-                assigned_stops.add(stop.stop_id)
+            for truck, available_stops in wave:
+                if available_stops and truck.truck_id not in truck_routes:
+                    truck_routes[truck.truck_id] = self._optimize_truck_route(
+                        truck, available_stops, dist_np, idx_map,
+                        stop_arrays.take([stop_rows[s.stop_id] for s in available_stops]),
+                        dist_i64)
+            
+            for truck in solved:
+                for stop in truck_routes[truck.truck_id].stops:
+                    assigned_stops.add(stop.stop_id)
+        
+        return {t.truck_id: truck_routes[t.truck_id] for t in truck_order}
+    
+    def _plan_wave(self, pending: List[Truck], compatible_stops: Dict[str, List[Stop]],
+                   assigned_stops: Set[int]) -> Tuple[List[Tuple[Truck, List[Stop]]], List[Truck]]:
+        """Split pending trucks into a wave that can be solved independently and the rest
+        
+        A truck joins the wave only if none of its open stops is wanted by a truck ahead
+        of it in the queue, so the result matches routing the trucks one at a time.
+        """
+        wave, deferred = [], []
+        claimed = set()
+        
+        for truck in pending:
+            available_stops = [s for s in compatible_stops[truck.truck_id]
+                               if s.stop_id not in assigned_stops]
+            stop_ids = {s.stop_id for s in available_stops}
+            if claimed.isdisjoint(stop_ids):
+                wave.append((truck, available_stops))
+            else:
+                deferred.append(truck)
+            claimed |= stop_ids
         
-        return truck_routes
+        return wave, deferred
     
     def _geocode_locations(self, stops: List[Stop], trucks: List[Truck]):
         """Geocode all stop and depot addresses"""
         logger.info(f"Geocoding {len(stops)} stops and {len(trucks)} trucks")
         
+        # Geocode each distinct address once (depots are often shared). The service's batch
+        # path skips cached addresses; with a keyed backend (Mapbox, ArcGIS) misses go out in
+        # bulk requests, while Nominatim is queried one address per second, serially
+        unique_addresses = list(dict.fromkeys(
+            [stop.address for stop in stops] + [truck.depot_address for truck in trucks]
+        ))
+        coords_by_address = dict(zip(unique_addresses, self.geocoding_service.geocode_batch(unique_addresses)))
+        
         for stop in stops:
-            coords = self.geocoding_service.geocode_address(stop.address)
+            coords = coords_by_address[stop.address]
             if coords:
                 stop.latitude, stop.longitude = coords
                 logger.info(f"Stop {stop.stop_id} geocoded to {coords}")
@@ -76,243 +460,226 @@ class RoutingEngine:
                 logger.warning(f"Failed to geocode stop {stop.stop_id}: {stop.address}")
         
         for truck in trucks:
-            coords = self.geocoding_service.geocode_address(truck.depot_address)
+            coords = coords_by_address[truck.depot_address]
             if coords:
                 truck.depot_latitude, truck.depot_longitude = coords
                 logger.info(f"Truck {truck.truck_id} depot geocoded to {coords}")
             else:
                 logger.warning(f"Failed to geocode truck {truck.truck_id} depot: {truck.depot_address}")
     
-    def _create_full_distance_matrix(self, stops: List[Stop], trucks: List[Truck]) -> Dict[Tuple[str, str], float]:
-        """Create distance matrix for all locations"""
-        locations = {}
+    def _prepare_models(self, stops: List[Stop], trucks: List[Truck]):
+        """Cache matrix keys, and time windows and shifts as minutes since midnight, on the models"""
+        for stop in stops:
+            stop._key = f"stop_{stop.stop_id}"
+            stop._tw_s = stop.time_window_start.hour * 60 + stop.time_window_start.minute
+            stop._tw_e = stop.time_window_end.hour * 60 + stop.time_window_end.minute
+        
+        for truck in trucks:
+            truck._key = f"depot_{truck.truck_id}"
+            truck._shift_s = truck.shift_start.hour * 60 + truck.shift_start.minute
+            truck._shift_e = truck.shift_end.hour * 60 + truck.shift_end.minute
+    
+    def _create_full_distance_matrix(self, stops: List[Stop],
+                                     trucks: List[Truck]) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+        """Create distance matrix for all locations
+        
+        Returns the miles matrix, the same matrix scaled for OR-Tools and a location
+        name -> row index map. Locations without coordinates are included with a 50 mile
+        default distance.
+        """
+        names = []
+        coords = []
         
         # Add depot locations
         for truck in trucks:
+            names.append(truck._key)
             if truck.depot_latitude and truck.depot_longitude:
-                locations[f"depot_{truck.truck_id}"] = (truck.depot_latitude, truck.depot_longitude)
+                coords.append((round(truck.depot_latitude, 5), round(truck.depot_longitude, 5)))
+            else:
+                coords.append(None)
         
         # Add stop locations
         for stop in stops:
+            names.append(stop._key)
             if stop.latitude and stop.longitude:
-                locations[f"stop_{stop.stop_id}"] = (stop.latitude, stop.longitude)
+                coords.append((round(stop.latitude, 5), round(stop.longitude, 5)))
+            else:
+                coords.append(None)
         
-        return self.geocoding_service.create_distance_matrix(locations)
+        # Distances between distinct coordinates, reused across calls for the same location set
+        coord_list, coord_dist = self._cached_coordinate_matrix([c for c in coords if c is not None])
+        coord_row = {c: i for i, c in enumerate(coord_list)}
+        
+        rows = np.array([coord_row[c] if c is not None else -1 for c in coords], dtype=np.int64)
+        valid = rows >= 0
+        dist_np = np.full((len(names), len(names)), DEFAULT_DISTANCE_MILES, dtype=np.float32)
+        dist_np[np.ix_(valid, valid)] = coord_dist[np.ix_(rows[valid], rows[valid])]
+        np.fill_diagonal(dist_np, 0.0)
+        
+        loc_index = {name: i for i, name in enumerate(names)}
+        return dist_np, self._scale_distances(dist_np), loc_index
+    
+    def _cached_coordinate_matrix(self, coords: List[Tuple[float, float]]) -> Tuple[List[Tuple[float, float]], np.ndarray]:
+        """Distance matrix over the distinct coordinates, served from the LRU cache when possible"""
+        key = frozenset(coords)
+        with self._matrix_cache_lock:
+            cached = self._matrix_cache.get(key)
+            if cached is not None:
+                self._matrix_cache.move_to_end(key)
+                return cached
+        
+        coord_list = list(dict.fromkeys(coords))
+        entry = (coord_list, self._build_distance_matrix_np(coord_list))
+        nbytes = entry[1].nbytes
+        if nbytes > MATRIX_CACHE_MAX_BYTES:
+            return entry
+        
+        with self._matrix_cache_lock:
+            if key not in self._matrix_cache:
+                self._matrix_cache[key] = entry
+                self._matrix_cache_bytes += nbytes
+            # Evict least recently used matrices until the cache fits its byte budget
+            while self._matrix_cache_bytes > MATRIX_CACHE_MAX_BYTES:
+                _, (_, evicted) = self._matrix_cache.popitem(last=False)
+                self._matrix_cache_bytes -= evicted.nbytes
+        return entry
     
-    def _get_compatible_stops(self, trucks: List[Truck], stops: List[Stop]) -> Dict[str, List[Stop]]:
+    def _scale_distances(self, dist: np.ndarray) -> np.ndarray:
+        """Miles to integer hundredths of a mile for OR-Tools; unusable entries get the default"""
+        dist = np.where(np.isfinite(dist) & (dist >= 0), dist, DEFAULT_DISTANCE_MILES)
+        scaled = np.rint(dist * 100).astype(np.int64)
+        np.fill_diagonal(scaled, 0)
+        return scaled
+    
+    def _build_distance_matrix_np(self, coords: List[Tuple[float, float]]) -> np.ndarray:
+        """Vectorized all-pairs haversine distances in miles (float32)"""
+        if not coords:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        lats = np.radians(np.array([lat for lat, _ in coords], dtype=np.float64))
+        lons = np.radians(np.array([lon for _, lon in coords], dtype=np.float64))
+        cos_lats = np.cos(lats)
+        
+        # Distances are symmetric: evaluate each pair once and mirror it
+        i, j = np.triu_indices(len(coords), 1)
+        a = np.sin((lats[i] - lats[j]) / 2) ** 2 + cos_lats[i] * cos_lats[j] * np.sin((lons[i] - lons[j]) / 2) ** 2
+        np.arcsin(np.sqrt(a, out=a), out=a)
+        a *= 2 * EARTH_RADIUS_MILES
+        
+        D = np.zeros((len(coords), len(coords)), dtype=np.float32)
+        D[i, j] = a
+        D[j, i] = a
+        return D
+    
+    def _get_compatible_stops(self, trucks: List[Truck], stops: List[Stop],
+                              arrays: Optional[StopArrays] = None) -> Dict[str, List[Stop]]:
         """Determine which stops are compatible with each truck"""
         compatible_stops = {}
+        if arrays is None:
+            arrays = StopArrays.from_stops(stops)
         
         for truck in trucks:
-            compatible = []
-            allowed_constraints = self.compatibility_rules.get(truck.truck_type, [])
+            # Special constraint, capacity and shift overlap checks for every stop at once
+            fits = ((arrays.constraint_bits & self._truck_masks.get(truck.truck_type, 0)) != 0) & (arrays.pallets <= truck.max_pallets)
+            fits &= ~((truck._shift_e < arrays.tw_s) | (truck._shift_s > arrays.tw_e))
             
-            for stop in stops:
-                # Check special constraint compatibility
-                if stop.special_constraint in allowed_constraints:
-                    # Check capacity
-                    if stop.pallets <= truck.max_pallets:
-                        # Check time window overlap with shift
-                        if self._check_time_compatibility(truck, stop):
-                            compatible.append(stop)
+            compatible = [stops[i] for i in np.flatnonzero(fits)]
             
             compatible_stops[truck.truck_id] = compatible
             logger.info(f"Truck {truck.truck_id} compatible with {len(compatible)} stops")
         
         return compatible_stops
     
-    def _check_time_compatibility(self, truck: Truck, stop: Stop) -> bool:
-        """Check if stop time window overlaps with truck shift"""
-        # Convert times to minutes since midnight for easier comparison
-        truck_start_mins = truck.shift_start.hour * 60 + truck.shift_start.minute
-        truck_end_mins = truck.shift_end.hour * 60 + truck.shift_end.minute
-        stop_start_mins = stop.time_window_start.hour * 60 + stop.time_window_start.minute
-        stop_end_mins = stop.time_window_end.hour * 60 + stop.time_window_end.minute
-        
-        # Check for overlap
-        return not (truck_end_mins < stop_start_mins or truck_start_mins > stop_end_mins)
-    
     def _optimize_truck_route(self, truck: Truck, stops: List[Stop], 
-                            distance_matrix: Dict[Tuple[str, str], float]) -> TruckRoute:
-        """Optimize route for a single truck using OR-Tools"""
+                            dist_np: np.ndarray, idx_map: Dict[str, int],
+                            arrays: Optional[StopArrays] = None,
+                            dist_i64: Optional[np.ndarray] = None) -> TruckRoute:
+        """Optimize route for a single truck using OR-Tools
+        
+        ``arrays`` holds the attributes of ``stops`` in the same order; ``dist_i64`` is
+        ``dist_np`` already scaled for the solver.
+        """
         if not stops:
             return self._create_empty_route(truck)
+        if arrays is None:
+            arrays = StopArrays.from_stops(stops)
         
-        # Create simplified distance matrix for this truck's stops
-        locations = [f"depot_{truck.truck_id}"] + [f"stop_{s.stop_id}" for s in stops]
-        n_locations = len(locations)
-        
-        # Build matrix
-        matrix = []
-        for i in range(n_locations):
-            row = []
-            for j in range(n_locations):
-                if i == j:
-                    row.append(0)
-                else:
-                    dist = distance_matrix.get((locations[i], locations[j]), 50)  # Default 50 miles
-                    # Ensure dist is a valid number before conversion
-                    try:
-                        if isinstance(dist, (int, float)) and dist >= 0:
-                            row.append(int(dist * 100))  # Convert to integers for OR-Tools
-                        else:
-                            row.append(5000)  # Default 50 miles * 100
-                    except (ValueError, TypeError):
-                        row.append(5000)  # Default 50 miles * 100
-            matrix.append(row)
-        
-        # Create routing model
-        manager = pywrapcp.RoutingIndexManager(n_locations, 1, 0)
-        routing = pywrapcp.RoutingModel(manager)
-        
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return matrix[from_node][to_node]
-        
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-        
-        # Add capacity constraint
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            if from_node == 0:  # Depot
-                return 0
-            return stops[from_node - 1].pallets
-        
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index,
-            0,  # null capacity slack
-            [truck.max_pallets],  # vehicle maximum capacities
-            True,  # start cumul to zero
-            'Capacity')
-        
-        # Add time window constraints
-        time_dimension_name = 'Time'
-        time_per_mile = 60 / truck.avg_speed_mph  # minutes per mile
-        
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            try:
-                distance_value = matrix[from_node][to_node]
-                travel_time = int(distance_value * time_per_mile / 100)
-            except (ValueError, TypeError):
-                travel_time = 60  # Default 1 hour travel time
-            service_time = 0 if to_node == 0 else stops[to_node - 1].service_time_minutes
-            return travel_time + service_time
-        
-        time_callback_index = routing.RegisterTransitCallback(time_callback)
-        
-        # Set time windows
-        time_windows = [(0, 24 * 60)]  # Depot open all day
-        for stop in stops:
-            start_mins = stop.time_window_start.hour * 60 + stop.time_window_start.minute
-            end_mins = stop.time_window_end.hour * 60 + stop.time_window_end.minute
-            time_windows.append((start_mins, end_mins))
-        
-        routing.AddDimension(
-            time_callback_index,
-            30,  # allow waiting time
-            24 * 60,  # maximum time per vehicle
-            False,  # Don't force start cumul to zero
-            time_dimension_name)
-        
-        time_dimension = routing.GetDimensionOrDie(time_dimension_name)
-        for location_idx, time_window in enumerate(time_windows):
-            index = manager.NodeToIndex(location_idx)
-            time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
-        
-        # Solve
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-        search_parameters.time_limit.FromSeconds(5)
-        
-        solution = routing.SolveWithParameters(search_parameters)
-        
-        if solution:
-            return self._extract_route_from_solution(truck, stops, routing, manager, solution, distance_matrix)
+        loc_idx = self._route_node_index(truck, stops, idx_map)
+        
+        # Integer hundredths of a mile for OR-Tools
+        if dist_i64 is not None:
+            matrix_np = dist_i64[np.ix_(loc_idx, loc_idx)]
         else:
-            # Fallback to greedy algorithm
-            return self._greedy_route(truck, stops, distance_matrix)
+            matrix_np = self._scale_distances(dist_np[np.ix_(loc_idx, loc_idx)])
+        
+        sequence = _solve_node_order(matrix_np, arrays, truck.max_pallets, truck.avg_speed_mph,
+                                     self.first_solution_strategy)
+        return self._route_for_sequence(truck, stops, sequence, dist_np, loc_idx, arrays)
+    
+    def _route_for_sequence(self, truck: Truck, stops: List[Stop], sequence: Optional[List[int]],
+                            dist_np: np.ndarray, loc_idx: np.ndarray, arrays: StopArrays) -> TruckRoute:
+        """Route for a solver result; falls back to the greedy algorithm when there is none"""
+        if sequence is None:
+            return self._greedy_route(truck, stops, dist_np, loc_idx, arrays)
+        return self._route_from_sequence(truck, stops, sequence, dist_np, loc_idx, arrays)
+    
+    def _route_node_index(self, truck: Truck, stops: List[Stop], idx_map: Dict[str, int]) -> np.ndarray:
+        """Matrix row of each routing node: node 0 is the depot, node k is stops[k - 1]"""
+        return np.array([idx_map[truck._key]] + [idx_map[s._key] for s in stops])
     
-    def _extract_route_from_solution(self, truck: Truck, stops: List[Stop], 
-                                   routing, manager, solution,
-                                   distance_matrix: Dict[Tuple[str, str], float]) -> TruckRoute:
-        """Extract route from OR-Tools solution"""
+    def _route_from_sequence(self, truck: Truck, stops: List[Stop], sequence: List[int],
+                             dist_np: np.ndarray, loc_idx: np.ndarray,
+                             arrays: StopArrays) -> TruckRoute:
+        """Build the truck route for a visiting order of routing nodes (node k is stops[k - 1])"""
         route_stops = []
         total_distance = 0
         total_pallets = 0
         
-        index = routing.Start(0)
-        current_time = truck.shift_start.hour * 60 + truck.shift_start.minute
-        base_date = datetime.now().date()
+        prev_node = 0
+        current_time = truck._shift_s
+        base_midnight = datetime.combine(datetime.now().date(), time(0, 0))
         
-        while not routing.IsEnd(index):
-            node = manager.IndexToNode(index)
-            next_index = solution.Value(routing.NextVar(index))
-            next_node = manager.IndexToNode(next_index)
+        for node in sequence:
+            if prev_node > 0:
+                # Travel from the previous stop after serving it
+                travel_time = dist_np[loc_idx[prev_node], loc_idx[node]] * 60 / truck.avg_speed_mph
+                current_time += travel_time + arrays.service[prev_node - 1]
+            else:
+                current_time += dist_np[loc_idx[0], loc_idx[node]] * 60 / truck.avg_speed_mph
+            
+            stop = stops[node - 1]
+            # Whole minutes, kept within the day
+            arrival_mins = max(0, min(24 * 60 - 1, int(current_time)))
+            arrival_time = base_midnight + timedelta(minutes=arrival_mins)
+            eta = f"{arrival_mins // 60:02d}:{arrival_mins % 60:02d}"
+            departure_time = arrival_time + timedelta(minutes=stop.service_time_minutes)
             
-            if node > 0:  # Not depot
-                stop = stops[node - 1]
-                arrival_mins = current_time
-                
-                # Ensure arrival_mins is an integer for time() constructor
-                try:
-                    arrival_mins_int = int(arrival_mins) if isinstance(arrival_mins, (int, float)) else 480  # Default 8 AM
-                    hours = arrival_mins_int // 60
-                    minutes = arrival_mins_int % 60
-                    # Ensure valid time ranges
-                    hours = max(0, min(23, hours))
-                    minutes = max(0, min(59, minutes))
-                    arrival_time = datetime.combine(base_date, time(hours, minutes))
-                except (ValueError, TypeError):
-                    arrival_time = datetime.combine(base_date, time(8, 0))  # Default 8 AM
-                departure_time = arrival_time + timedelta(minutes=stop.service_time_minutes)
-                
-                prev_location = f"depot_{truck.truck_id}" if len(route_stops) == 0 else f"stop_{route_stops[-1].stop_id}"
-                curr_location = f"stop_{stop.stop_id}"
-                distance = distance_matrix.get((prev_location, curr_location), 50)
-                
-                route_stop = RouteStop(
-                    stop_id=stop.stop_id,
-                    eta=arrival_time.strftime("%H:%M"),
-                    arrival_time=arrival_time,
-                    departure_time=departure_time,
-                    distance_from_previous=distance,
-                    notes=self._get_stop_notes(stop, len(route_stops) + 1),
-                    latitude=stop.latitude,
-                    longitude=stop.longitude,
-                    address=stop.address,
-                    pallets=stop.pallets,
-                    time_window_start=stop.time_window_start.strftime("%H:%M"),
-                    time_window_end=stop.time_window_end.strftime("%H:%M"),
-                    estimated_arrival=arrival_time.strftime("%H:%M")
-                )
-                
-                route_stops.append(route_stop)
-                total_distance += distance
-                total_pallets += stop.pallets
+            distance = float(dist_np[loc_idx[prev_node], loc_idx[node]])
             
-            if not routing.IsEnd(next_index) and next_node > 0:
-                # Calculate travel time to next stop
-                travel_time = distance_matrix.get(
-                    (f"stop_{stops[node - 1].stop_id}" if node > 0 else f"depot_{truck.truck_id}",
-                     f"stop_{stops[next_node - 1].stop_id}"),
-                    50) * 60 / truck.avg_speed_mph
-                current_time += travel_time + (stops[node - 1].service_time_minutes if node > 0 else 0)
+            route_stop = RouteStop(
+                stop_id=stop.stop_id,
+                eta=eta,
+                arrival_time=arrival_time,
+                departure_time=departure_time,
+                distance_from_previous=distance,
+                notes=self._get_stop_notes(stop, len(route_stops) + 1),
+                latitude=stop.latitude,
+                longitude=stop.longitude,
+                address=stop.address,
+                pallets=stop.pallets,
+                time_window_start=f"{stop._tw_s // 60:02d}:{stop._tw_s % 60:02d}",
+                time_window_end=f"{stop._tw_e // 60:02d}:{stop._tw_e % 60:02d}",
+                estimated_arrival=eta
+            )
             
-            index = next_index
+            route_stops.append(route_stop)
+            total_distance += distance
+            total_pallets += stop.pallets
+            prev_node = node
         
         # Add return to depot distance
         if route_stops:
-            last_stop_location = f"stop_{route_stops[-1].stop_id}"
-            depot_location = f"depot_{truck.truck_id}"
-            return_distance = distance_matrix.get((last_stop_location, depot_location), 50)
+            return_distance = float(dist_np[loc_idx[prev_node], loc_idx[0]])
             total_distance += return_distance
         
         total_time_hours = total_distance / truck.avg_speed_mph + len(route_stops) * 0.25
@@ -331,58 +698,40 @@ class RoutingEngine:
         )
     
     def _greedy_route(self, truck: Truck, stops: List[Stop], 
-                     distance_matrix: Dict[Tuple[str, str], float]) -> TruckRoute:
+                     dist_np: np.ndarray, loc_idx: np.ndarray,
+                     arrays: Optional[StopArrays] = None) -> TruckRoute:
         """Fallback greedy routing algorithm"""
         route_stops = []
-        remaining_stops = stops.copy()
-        current_location = f"depot_{truck.truck_id}"
-        current_time = truck.shift_start.hour * 60 + truck.shift_start.minute
         total_distance = 0
         total_pallets = 0
-        base_date = datetime.now().date()
+        base_midnight = datetime.combine(datetime.now().date(), time(0, 0))
+        
+        # Flatten the truck's problem to arrays for the selection kernel
+        if arrays is None:
+            arrays = StopArrays.from_stops(stops)
+        dist = np.ascontiguousarray(dist_np[np.ix_(loc_idx, loc_idx)])
+        order, arrivals = _greedy_core(
+            dist,
+            arrays.pallets,
+            arrays.tw_e,
+            arrays.service,
+            truck.max_pallets,
+            truck._shift_s,
+            float(truck.avg_speed_mph)
+        )
         
-        while remaining_stops and total_pallets < truck.max_pallets:
-            # Find nearest feasible stop
-            best_stop = None
-            best_distance = float('inf')
-            
-            for stop in remaining_stops:
-                if total_pallets + stop.pallets > truck.max_pallets:
-                    continue
-                
-                stop_location = f"stop_{stop.stop_id}"
-                distance = distance_matrix.get((current_location, stop_location), 50)
-                # Ensure distance is valid before calculations
-                if not isinstance(distance, (int, float)) or distance < 0:
-                    distance = 50  # Default 50 miles
-                travel_time = distance * 60 / truck.avg_speed_mph
-                arrival_time = current_time + travel_time
-                
-                # Check time window
-                stop_start_mins = stop.time_window_start.hour * 60 + stop.time_window_start.minute
-                stop_end_mins = stop.time_window_end.hour * 60 + stop.time_window_end.minute
-                
-                if arrival_time <= stop_end_mins and distance < best_distance:
-                    best_stop = stop
-                    best_distance = distance
+        prev_node = 0
+        for best_pos, arrival_mins in zip(order.tolist(), arrivals.tolist()):
+            best_stop = stops[best_pos]
+            best_distance = float(dist[prev_node, best_pos + 1])
             
-            if not best_stop:
-                break
-            
-            # Add stop to route
-            try:
-                if isinstance(best_distance, (int, float)) and best_distance >= 0:
-                    arrival_mins = current_time + int(best_distance * 60 / truck.avg_speed_mph)
-                else:
-                    arrival_mins = current_time + 60  # Default 1 hour travel time
-            except (ValueError, TypeError):
-                arrival_mins = current_time + 60  # Default 1 hour travel time
-            arrival_time = datetime.combine(base_date, time(arrival_mins // 60, arrival_mins % 60))
+            arrival_time = base_midnight + timedelta(minutes=arrival_mins)
+            eta = f"{arrival_mins // 60:02d}:{arrival_mins % 60:02d}"
             departure_time = arrival_time + timedelta(minutes=best_stop.service_time_minutes)
             
             route_stop = RouteStop(
                 stop_id=best_stop.stop_id,
-                eta=arrival_time.strftime("%H:%M"),
+                eta=eta,
                 arrival_time=arrival_time,
                 departure_time=departure_time,
                 distance_from_previous=best_distance,
@@ -391,21 +740,19 @@ class RoutingEngine:
                 longitude=best_stop.longitude,
                 address=best_stop.address,
                 pallets=best_stop.pallets,
-                time_window_start=best_stop.time_window_start.strftime("%H:%M"),
-                time_window_end=best_stop.time_window_end.strftime("%H:%M"),
-                estimated_arrival=arrival_time.strftime("%H:%M")
+                time_window_start=f"{best_stop._tw_s // 60:02d}:{best_stop._tw_s % 60:02d}",
+                time_window_end=f"{best_stop._tw_e // 60:02d}:{best_stop._tw_e % 60:02d}",
+                estimated_arrival=eta
             )
             
             route_stops.append(route_stop)
             total_distance += best_distance
             total_pallets += best_stop.pallets
-            current_location = f"stop_{best_stop.stop_id}"
-            current_time = arrival_mins + best_stop.service_time_minutes
-            remaining_stops.remove(best_stop)
+            prev_node = best_pos + 1
         
         # Add return distance
         if route_stops:
-            return_distance = distance_matrix.get((current_location, f"depot_{truck.truck_id}"), 50)
+            return_distance = float(dist[prev_node, 0])
             total_distance += return_distance
         
         total_time_hours = total_distance / truck.avg_speed_mph + len(route_stops) * 0.25
@@ -441,15 +788,14 @@ class RoutingEngine:
     def _get_stop_notes(self, stop: Stop, position: int) -> str:
         """Generate notes for a stop"""
         notes = []
+        constraint = stop.special_constraint
         
-        if position == 1 and stop.special_constraint == SpecialConstraint.FRAGILE:
+        if position == 1 and constraint == SpecialConstraint.FRAGILE:
             notes.append("Fragile - loaded last for easy access")
-        elif stop.special_constraint == SpecialConstraint.REFRIGERATED:
-            notes.append("Temperature-controlled delivery")
-        elif stop.special_constraint == SpecialConstraint.FROZEN:
-            notes.append("Frozen goods - maintain cold chain")
-        elif stop.special_constraint == SpecialConstraint.HAZMAT:
-            notes.append("Hazmat - follow safety protocols")
+        else:
+            note = self._note_templates.get(constraint)
+            if note:
+                notes.append(note)
         
         if stop.time_window_end.hour < 12:
             notes.append("Morning delivery required")
@@ -462,7 +808,7 @@ class RoutingEngine:
         if not route_stops:
             return f"Truck {truck.truck_id} has no assigned stops due to capacity or compatibility constraints."
         
-        stop_ids = [rs.stop_id for rs in route_stops]
+        stop_ids = {rs.stop_id for rs in route_stops}
         assigned_stops = [s for s in all_stops if s.stop_id in stop_ids]
         
         reasons = []
@@ -485,4 +831,4 @@ class RoutingEngine:
         if morning_stops:
             reasons.append(f"prioritized {morning_stops} morning deliveries")
         
-        return f"Truck {truck.truck_id} was {'; '.join(reasons)}."
\ No newline at end of file
+        return f"Truck {truck.truck_id} was {'; '.join(reasons)}."
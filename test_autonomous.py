@@ -8,9 +8,19 @@ import requests
 import json
 import time
 from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "http://localhost:8000"
 
+# One pooled session for every test, so calls reuse the keep-alive connection.
+# No default Content-Type: json= sets it, and it would break the multipart upload
+SESSION = requests.Session()
+_adapter = HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1))
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 def test_autonomous_routing():
     """Test the /route/auto endpoint"""
     print("🤖 Testing Autonomous Routing...")
@@ -29,7 +39,7 @@ def test_autonomous_routing():
     }
     
     try:
-        response = requests.post(f"{BASE_URL}/route/auto", json=payload, timeout=30)
+        response = SESSION.post(f"{BASE_URL}/route/auto", json=payload, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -75,7 +85,7 @@ def test_enhanced_csv_parsing():
         }
         
         # We'll use the upload endpoint but with only stops (should auto-generate trucks)
-        response = requests.post(f"{BASE_URL}/route/upload", files=files, timeout=30)
+        response = SESSION.post(f"{BASE_URL}/route/upload", files=files, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -103,14 +113,20 @@ def test_natural_language_constraints():
         "Minimize fuel costs and complete all deliveries before 3 PM"
     ]
     
-    for constraint in test_constraints:
+    def post_constraint(constraint: str):
         payload = {
             "addresses": "123 Test St, Atlanta GA\n456 Sample Ave, Atlanta GA",
             "constraints": constraint
         }
-        
+        return SESSION.post(f"{BASE_URL}/route/auto", json=payload, timeout=20)
+    
+    # The requests share no state, so send them together; results print in list order
+    with ThreadPoolExecutor(max_workers=len(test_constraints)) as executor:
+        futures = [executor.submit(post_constraint, constraint) for constraint in test_constraints]
+    
+    for constraint, future in zip(test_constraints, futures):
         try:
-            response = requests.post(f"{BASE_URL}/route/auto", json=payload, timeout=20)
+            response = future.result()
             
             if response.status_code == 200:
                 result = response.json()
@@ -141,7 +157,7 @@ def test_live_rerouting():
     }
     
     try:
-        initial_response = requests.post(f"{BASE_URL}/route/auto", json=initial_payload, timeout=20)
+        initial_response = SESSION.post(f"{BASE_URL}/route/auto", json=initial_payload, timeout=20)
         
         if initial_response.status_code == 200:
             initial_result = initial_response.json()
@@ -164,7 +180,7 @@ def test_live_rerouting():
             }
             
             # Note: This will likely fail due to missing stop/truck data, but tests the endpoint
-            reroute_response = requests.post(f"{BASE_URL}/route/recalculate", json=reroute_payload, timeout=20)
+            reroute_response = SESSION.post(f"{BASE_URL}/route/recalculate", json=reroute_payload, timeout=20)
             
             if reroute_response.status_code == 200:
                 print("   ✅ Re-routing endpoint responded successfully")
@@ -187,14 +203,14 @@ def test_health_and_endpoints():
     
     try:
         # Test health endpoint
-        health_response = requests.get(f"{BASE_URL}/health", timeout=10)
+        health_response = SESSION.get(f"{BASE_URL}/health", timeout=10)
         if health_response.status_code == 200:
             print("✅ Health check passed")
         else:
             print(f"❌ Health check failed: {health_response.status_code}")
         
         # Test root endpoint
-        root_response = requests.get(f"{BASE_URL}/", timeout=10)
+        root_response = SESSION.get(f"{BASE_URL}/", timeout=10)
         if root_response.status_code == 200:
             root_data = root_response.json()
             endpoints = root_data.get('endpoints', {})
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Behaviour checks for the geocoding service (no network: geocoders and HTTP are faked)
+Run directly or with pytest
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+
+import utils.geocoding as geocoding
+from utils.geocoding import (ArcGISBackend, GeoPoint, GeocodingService, MapboxBackend, NominatimBackend,
+                             SlidingWindowLimiter, build_spatial_index, distance)
+
+
+def _fake_geocoder(calls, fail=()):
+    """Stand-in for a geopy geocode call: records each address, returns a fixed point"""
+    def geocode(address):
+        calls.append(address)
+        if address in fail:
+            raise RuntimeError("timeout")
+        return SimpleNamespace(latitude=33.75, longitude=-84.39)
+    return geocode
+
+
+@contextmanager
+def _patched(module, **attrs):
+    """Temporarily replace module attributes"""
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def _service(cache_path=""):
+    """Service with its Nominatim calls faked; returns (service, list of requested addresses)"""
+    calls = []
+    service = GeocodingService(cache_path=cache_path)
+    service._geocode = _fake_geocoder(calls)
+    service.backend = NominatimBackend(service._geocode)
+    return service, calls
+
+
+def test_cache_hit_and_normalized_keys():
+    """Case, punctuation and spacing variants share one lookup"""
+    service, calls = _service()
+    for address in ["123 Main St", "123 main st", "123 Main St.", "  123  Main   St. "]:
+        assert service.geocode_address(address) == (33.75, -84.39)
+    assert calls == ["123 Main St"]
+
+
+def test_disk_cache_survives_restart():
+    """A second service on the same cache file makes no requests"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "geocache.db")
+        first, first_calls = _service(path)
+        first.geocode_address("1 Peachtree St, Atlanta")
+        second, second_calls = _service(path)
+        assert second.geocode_address("1 PEACHTREE ST., Atlanta") == (33.75, -84.39)
+        assert second.geocode_batch(["1 Peachtree St, Atlanta"]) == [(33.75, -84.39)]
+        assert first_calls == ["1 Peachtree St, Atlanta"] and second_calls == []
+        first._db.close()
+        second._db.close()
+
+
+def test_batch_dedupes_and_keeps_order():
+    """Repeated and variant addresses are requested once; results follow the input order"""
+    service, calls = _service()
+    results = service.geocode_batch(["a St", "b St", "A St.", "a St"])
+    assert results == [(33.75, -84.39)] * 4
+    assert calls == ["a St", "b St"]
+    assert service.geocode_batch(["b St"]) == [(33.75, -84.39)] and len(calls) == 2
+
+
+def test_batch_failure_is_not_cached():
+    """A failed request leaves its address uncached, so it is retried next time"""
+    calls = []
+    service = GeocodingService(cache_path="")
+    service.backend = NominatimBackend(_fake_geocoder(calls, fail={"bad St"}))
+    assert service.geocode_batch(["ok St", "bad St"]) == [(33.75, -84.39), None]
+    service.backend = NominatimBackend(_fake_geocoder(calls))
+    assert service.geocode_batch(["bad St"]) == [(33.75, -84.39)]
+    assert calls == ["ok St", "bad St", "bad St"]
+
+
+def test_backend_selection():
+    """GEOCODER_BACKEND picks a configured provider and falls back to Nominatim otherwise"""
+    saved = {k: os.environ.get(k) for k in ("GEOCODER_BACKEND", "MAPBOX_ACCESS_TOKEN", "ARCGIS_API_KEY")}
+    try:
+        for key in saved:
+            os.environ.pop(key, None)
+        assert isinstance(GeocodingService(cache_path="").backend, NominatimBackend)
+        os.environ["GEOCODER_BACKEND"] = "mapbox"
+        assert isinstance(GeocodingService(cache_path="").backend, NominatimBackend)  # no token
+        os.environ["MAPBOX_ACCESS_TOKEN"] = "token"
+        assert isinstance(GeocodingService(cache_path="").backend, MapboxBackend)
+        os.environ["GEOCODER_BACKEND"] = "ArcGIS"
+        os.environ["ARCGIS_API_KEY"] = "key"
+        assert isinstance(GeocodingService(cache_path="").backend, ArcGISBackend)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_mapbox_batch_parsing():
+    """One POST per batch; misses come back as None in input order"""
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={"batch": [
+            {"features": [{"geometry": {"coordinates": [-84.39, 33.75]}}]},
+            {"features": []},
+        ]})
+
+    backend = MapboxBackend("token")
+    backend._client = httpx.Client(transport=httpx.MockTransport(handler))
+    assert backend.batch(["1 A St", "nowhere"]) == [(33.75, -84.39), None]
+    assert requests == [[{"q": "1 A St", "limit": 1}, {"q": "nowhere", "limit": 1}]]
+
+
+def test_arcgis_batch_parsing():
+    """Unordered results are placed by ResultID; zero-score matches are misses"""
+    def handler(request):
+        return httpx.Response(200, json={"locations": [
+            {"attributes": {"ResultID": 1}, "score": 0, "location": {"x": 0, "y": 0}},
+            {"attributes": {"ResultID": 0}, "score": 98, "location": {"x": -84.39, "y": 33.75}},
+        ]})
+
+    backend = ArcGISBackend("key")
+    backend._client = httpx.Client(transport=httpx.MockTransport(handler))
+    assert backend.batch(["1 A St", "nowhere"]) == [(33.75, -84.39), None]
+
+
+class _FakeAsyncNominatim:
+    """Async geopy geocoder stand-in; records requested addresses on the class"""
+    calls = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def geocode(self, address):
+        type(self).calls.append(address)
+        await asyncio.sleep(0)
+        return None if address == "nowhere" else SimpleNamespace(latitude=40.0, longitude=-75.0)
+
+
+def test_geocode_many_aiohttp_path():
+    """Only uncached, deduplicated addresses go out; misses come back as None"""
+    service, calls = _service()
+    service.geocode_address("cached St")
+    _FakeAsyncNominatim.calls = []
+    with _patched(geocoding, Nominatim=_FakeAsyncNominatim, NOMINATIM_MIN_INTERVAL=0,
+                  AioHTTPAdapter=SimpleNamespace(is_available=True)):
+        results = asyncio.run(service.geocode_many(["x St", "cached St", "X st.", "nowhere"]))
+    assert results == [(40.0, -75.0), (33.75, -84.39), (40.0, -75.0), None]
+    assert sorted(_FakeAsyncNominatim.calls) == ["nowhere", "x St"]
+
+
+def test_geocode_many_thread_fallback():
+    """Without aiohttp the sync geocoder runs in threads, still once per cache key"""
+    service, calls = _service()
+    with _patched(geocoding, AioHTTPAdapter=SimpleNamespace(is_available=False)):
+        results = asyncio.run(service.geocode_many(["a St", "b St", "A St"]))
+    assert results == [(33.75, -84.39)] * 3
+    assert sorted(calls) == ["a St", "b St"]
+
+
+class _FakeNominatim:
+    """Sync geopy geocoder stand-in; notes which thread each instance serves"""
+    calls = []
+
+    def __init__(self, **kwargs):
+        self.thread = threading.get_ident()
+
+    def geocode(self, address):
+        assert threading.get_ident() == self.thread, "geocoder shared across threads"
+        type(self).calls.append(address)
+        return SimpleNamespace(latitude=40.0, longitude=-75.0)
+
+
+def test_geocode_many_threaded():
+    """Misses are geocoded once each on worker threads; results keep the input order"""
+    service, _ = _service()
+    service.geocode_address("cached St")
+    _FakeNominatim.calls = []
+    with _patched(geocoding, Nominatim=_FakeNominatim):
+        results = service.geocode_many_threaded(["a St", "cached St", "b St", "A St."],
+                                                max_inflight=2, min_delay=0)
+    assert results == [(40.0, -75.0), (33.75, -84.39), (40.0, -75.0), (40.0, -75.0)]
+    assert sorted(_FakeNominatim.calls) == ["a St", "b St"]
+
+
+def test_sliding_window_limiter():
+    """No more than max_calls start in any period, across threads"""
+    limiter = SlidingWindowLimiter(max_calls=2, period=0.2)
+    starts = []
+    workers = [threading.Thread(target=lambda: (limiter.acquire(), starts.append(time.monotonic())))
+               for _ in range(5)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    starts.sort()
+    assert all(later - earlier >= 0.19 for earlier, later in zip(starts, starts[2:]))
+
+
+def test_spatial_index_matches_brute_force():
+    """k-nearest over a metro area agrees with a haversine scan"""
+    rng = np.random.default_rng(7)
+    service = GeocodingService(cache_path="")
+    locations = {f"S{i}": (33.75 + rng.uniform(-0.4, 0.4), -84.39 + rng.uniform(-0.4, 0.4))
+                 for i in range(300)}
+    index = build_spatial_index(locations)
+    for lat, lon in zip(33.75 + rng.uniform(-0.5, 0.5, 25), -84.39 + rng.uniform(-0.5, 0.5, 25)):
+        scan = sorted((service.calculate_distance((lat, lon), c), sid) for sid, c in locations.items())
+        found = index.nearest((lat, lon), k=3)
+        assert [sid for sid, _ in found] == [sid for _, sid in scan[:3]]
+        assert np.allclose([d for _, d in found], [d for d, _ in scan[:3]])
+    assert len(index.nearest((33.75, -84.39), k=500)) == 300
+    assert build_spatial_index({}).nearest((33.75, -84.39)) == []
+
+
+def _random_locations(n, seed=11):
+    rng = np.random.default_rng(seed)
+    return {f"L{i}": (33.75 + rng.uniform(-1, 1), -84.39 + rng.uniform(-1, 1)) for i in range(n)}
+
+
+def test_lazy_distance_matrix_matches_dense():
+    """Every lazily read pair equals the dense float64 matrix; symmetric reads share a cache entry"""
+    service = GeocodingService(cache_path="")
+    locations = _random_locations(40)
+    lazy = service.lazy_distance_matrix(locations)
+    dense = service.create_distance_matrix(locations, dtype=np.float64)
+    for a in locations:
+        for b in locations:
+            assert abs(lazy[a, b] - dense[a, b]) < 1e-9
+            assert lazy(b, a) == lazy[a, b]
+    assert lazy._pair.cache_info().currsize == 40 * 39 // 2
+    assert len(lazy) == len(dense) == 40
+    to_dense = lazy.to_dense(np.float64)
+    assert to_dense.ids == dense.ids and np.allclose(to_dense.D, dense.D, rtol=0, atol=1e-9)
+
+
+def test_geopoint_distances_match_tuples():
+    """GeoPoints, tuples and mixed arguments give the same haversine, also via precise=True"""
+    service = GeocodingService(cache_path="")
+    coords = list(_random_locations(10, seed=3).values())
+    points = [GeoPoint.from_degrees(lat, lon) for lat, lon in coords]
+    for c1, p1 in zip(coords, points):
+        for c2, p2 in zip(coords, points):
+            expected = service.calculate_distance(c1, c2)
+            assert abs(distance(p1, p2) - expected) < 1e-9
+            assert abs(service.calculate_distance(p1, c2) - expected) < 1e-9
+            assert abs(service.calculate_distance(c1, p2) - expected) < 1e-9
+            assert abs(service.calculate_distance(p1, p2, precise=True) -
+                       service.calculate_distance(c1, c2, precise=True)) < 1e-6
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+    print("✅ Geocoding checks passed")
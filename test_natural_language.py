@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Regression checks for rule-based natural language analysis (no server or API key needed)
+Run directly or with pytest
+"""
+
+from services.natural_language import NaturalLanguageProcessor
+
+nlp = NaturalLanguageProcessor()
+
+
+def test_cost_strategies():
+    """Strategy detection matches inflected and compound words"""
+    cases = {
+        "minimize distances driven": ["distance_optimization"],
+        "Minimize total times": ["time_optimization"],
+        "reduce overtime": ["time_optimization", "overtime_prevention"],
+        "reduce fuel and miles": ["fuel_optimization", "distance_optimization"],
+        "reducing mileage": ["distance_optimization"],
+        "minimizing drive time": ["time_optimization"],
+        "minimise the distance": ["distance_optimization"],
+        "Reduced fuel spend": ["fuel_optimization"],
+        "reduce fuel, smile at customers": ["fuel_optimization"],
+        "minimize timely distance": ["distance_optimization"],
+    }
+    for instruction, expected in cases.items():
+        result = nlp.analyze_cost_targets(instruction)
+        assert result.get("strategies") == expected, (instruction, result)
+
+
+def test_cost_target_without_reduction():
+    """A dollar target is extracted; strategies need a reduce/minimize word"""
+    result = nlp.analyze_cost_targets("Keep fuel cost at $250.50 and watch the time")
+    assert result == {"target_cost": 250.5}, result
+
+
+if __name__ == "__main__":
+    test_cost_strategies()
+    test_cost_target_without_reduction()
+    print("✅ Natural language checks passed")
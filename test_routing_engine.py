@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Checks for the routing engine's exact small-route solver, wave planning and solver pool
+(no geocoding or network)
+Run directly or with pytest
+"""
+
+from datetime import time
+from itertools import permutations
+from types import SimpleNamespace
+
+import numpy as np
+
+import services.routing_engine as routing_engine
+from models.models import SpecialConstraint, Stop, Truck, TruckType
+from services.routing_engine import DAY_MINUTES, MAX_WAIT_MINUTES, RoutingEngine, _exact_route_order
+from utils.geocoding import GeocodingService
+
+
+def _feasible(order, transit, tw_s, tw_e):
+    """Whether some schedule visits ``order`` in its windows, tracked minute by minute
+
+    Independent of the solver's interval arithmetic: the set of reachable arrival
+    minutes is shifted by each arc's transit, widened by up to MAX_WAIT_MINUTES of
+    waiting, and masked to the next stop's window.
+    """
+    reachable = np.ones(DAY_MINUTES + 1, dtype=bool)  # free start within the day
+    node = 0
+    for nxt in order:
+        arrive = np.zeros_like(reachable)
+        t = transit[node][nxt]
+        if t <= DAY_MINUTES:
+            arrive[t:] = reachable[:DAY_MINUTES + 1 - t]
+        arrive = np.convolve(arrive, np.ones(MAX_WAIT_MINUTES + 1))[:DAY_MINUTES + 1] > 0
+        window = np.zeros_like(reachable)
+        window[tw_s[nxt - 1]:tw_e[nxt - 1] + 1] = True
+        reachable = arrive & window
+        node = nxt
+    back = transit[node][0]
+    return bool(reachable[:max(0, DAY_MINUTES + 1 - back)].any())
+
+
+def _cost(order, cost):
+    nodes = [0, *order, 0]
+    return sum(cost[a][b] for a, b in zip(nodes, nodes[1:]))
+
+
+def _instance(rng, n):
+    """Random depot + ``n`` stops in a plane: cost in hundredths of a mile, windows in minutes"""
+    xy = rng.uniform(0, 30, size=(n + 1, 2))
+    miles = np.sqrt(((xy[:, None, :] - xy[None, :, :]) ** 2).sum(-1))
+    cost = (miles * 100).astype(np.int64)
+    service = np.concatenate(([0], rng.integers(5, 30, n)))
+    transit = ((miles * 60 / 45).astype(np.int64) + service[None, :])
+    tw_s = rng.integers(360, 720, n)
+    tw_e = np.minimum(tw_s + rng.integers(20, 240, n), DAY_MINUTES)
+    return cost.tolist(), transit.tolist(), tw_s.tolist(), tw_e.tolist()
+
+
+def test_exact_order_matches_brute_force():
+    """Same feasibility and optimal cost as scoring every permutation"""
+    rng = np.random.default_rng(42)
+    outcomes = set()
+    for trial in range(60):
+        n = 1 + trial % 6
+        cost, transit, tw_s, tw_e = _instance(rng, n)
+        feasible = [p for p in permutations(range(1, n + 1)) if _feasible(p, transit, tw_s, tw_e)]
+        order = _exact_route_order(cost, transit, tw_s, tw_e)
+        if not feasible:
+            assert order is None, (trial, order)
+            outcomes.add("infeasible")
+            continue
+        assert order is not None and sorted(order) == list(range(1, n + 1)), (trial, order)
+        assert _feasible(order, transit, tw_s, tw_e), (trial, order)
+        assert _cost(order, cost) == min(_cost(p, cost) for p in feasible), trial
+        outcomes.add("feasible")
+    assert outcomes == {"feasible", "infeasible"}
+
+
+def test_exact_order_ignores_windows_when_open():
+    """With all-day windows the answer is the shortest tour"""
+    rng = np.random.default_rng(5)
+    cost, transit, _, _ = _instance(rng, 6)
+    order = _exact_route_order(cost, transit, [0] * 6, [DAY_MINUTES] * 6)
+    assert _cost(order, cost) == min(_cost(p, cost) for p in permutations(range(1, 7)))
+
+
+def test_plan_wave_defers_overlapping_trucks():
+    """A truck waits for a later wave if a truck ahead of it, even a deferred one, wants its stops"""
+    stops = {i: SimpleNamespace(stop_id=i) for i in range(1, 7)}
+    wanted = {"A": [1, 2], "B": [3], "C": [2, 4], "D": [4, 5], "E": [6]}
+    trucks = [SimpleNamespace(truck_id=t) for t in wanted]
+    compatible = {t: [stops[i] for i in ids] for t, ids in wanted.items()}
+    engine = RoutingEngine()
+
+    wave, deferred = engine._plan_wave(trucks, compatible, set())
+    assert [(t.truck_id, [s.stop_id for s in available]) for t, available in wave] == \
+        [("A", [1, 2]), ("B", [3]), ("E", [6])]
+    assert [t.truck_id for t in deferred] == ["C", "D"]
+
+    # Once A has taken 1 and 2, C no longer overlaps it, but D still waits for C
+    wave, deferred = engine._plan_wave(deferred, compatible, {1, 2, 3, 6})
+    assert [(t.truck_id, [s.stop_id for s in available]) for t, available in wave] == [("C", [4])]
+    assert [t.truck_id for t in deferred] == ["D"]
+
+
+def _fleet(seed=8):
+    """Two trucks with disjoint stop sets large enough for OR-Tools, plus one small exact route"""
+    rng = np.random.default_rng(seed)
+    coords, stops = {}, []
+    kinds = [SpecialConstraint.FRAGILE] * 14 + [SpecialConstraint.HAZMAT] * 14 + [SpecialConstraint.REFRIGERATED] * 4
+    for i, kind in enumerate(kinds):
+        address = f"{i} Stop St"
+        coords[address] = (33.75 + rng.uniform(-0.3, 0.3), -84.39 + rng.uniform(-0.3, 0.3))
+        start = int(rng.choice([6, 8, 10]))
+        stops.append(Stop(stop_id=i + 1, address=address, time_window_start=time(start, 0),
+                          time_window_end=time(start + 6, 0), pallets=1, special_constraint=kind))
+    trucks = []
+    for k, truck_type in enumerate([TruckType.DRY, TruckType.HAZMAT, TruckType.REFRIGERATED]):
+        address = f"Depot {k}"
+        coords[address] = (33.75 + rng.uniform(-0.1, 0.1), -84.39 + rng.uniform(-0.1, 0.1))
+        trucks.append(Truck(truck_id=f"T{k}", depot_address=address, max_pallets=20, truck_type=truck_type,
+                            shift_start=time(6, 0), shift_end=time(18, 0)))
+    return coords, stops, trucks
+
+
+def _route(coords, stops, trucks):
+    engine = RoutingEngine()
+    engine.geocoding_service = GeocodingService(cache_path="")
+    engine.geocoding_service.geocode_batch = lambda addresses, size=50: [coords.get(a) for a in addresses]
+    routes = engine.route_trucks(stops, trucks)
+    return {truck_id: ([s.stop_id for s in r.stops], r.total_miles) for truck_id, r in routes.items()}
+
+
+def test_pool_routes_match_serial():
+    """Solving a wave's OR-Tools trucks in the process pool gives the serial routes"""
+    coords, stops, trucks = _fleet()
+    serial = _route(coords, stops, trucks)
+
+    saved = (routing_engine.PARALLEL_ROUTING, routing_engine.ROUTE_WORKERS, routing_engine.PARALLEL_MIN_STOPS)
+    routing_engine.PARALLEL_ROUTING, routing_engine.ROUTE_WORKERS, routing_engine.PARALLEL_MIN_STOPS = True, 2, 0
+    try:
+        pooled = _route(coords, stops, trucks)
+        assert routing_engine._route_pool is not None, "wave was not sent to the pool"
+    finally:
+        routing_engine.shutdown_route_pool()
+        routing_engine.PARALLEL_ROUTING, routing_engine.ROUTE_WORKERS, routing_engine.PARALLEL_MIN_STOPS = saved
+
+    assert pooled == serial
+    assert [len(serial[t][0]) for t in ("T0", "T1", "T2")] == [14, 14, 4]
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+    print("✅ Routing engine checks passed")
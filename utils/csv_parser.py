@@ -1,5 +1,9 @@
-import pandas as pd
+import csv
+import io
+import math
+import re
 from datetime import time
+from functools import lru_cache
 from typing import List, Tuple, Optional
 from models.models import Stop, Truck, SpecialConstraint, TruckType
 from services.natural_language import NaturalLanguageProcessor
@@ -7,6 +11,52 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Cells read as missing, matching the pandas read_csv defaults the parsers used to rely on
+_NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+})
+
+# Header keywords per stop field; a column maps to every category whose keywords it contains
+_CATEGORY_KEYWORDS = {
+    'address': ('address', 'addr', 'location', 'destination'),
+    'stop_id': ('stopid', 'stop_id', 'id', 'stop'),
+    'time_window': ('timewindow', 'time_window', 'window', 'time'),
+    'pallets': ('pallets', 'pallet', 'quantity', 'qty', 'units'),
+    'special': ('special', 'constraint', 'type', 'handling'),
+}
+
+# Plain decimal numbers, as accepted by float() minus inf/nan spellings
+_NUMBER_RE = re.compile(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*$')
+
+
+def _cell(value: Optional[str]) -> Optional[str]:
+    """Raw CSV cell, or None when missing"""
+    return None if value is None or value in _NA_VALUES else value
+
+
+def _int_column(rows: List[dict], column: Optional[str]) -> List[Optional[int]]:
+    """Whole-column int parse (truncating like int(float(x))); None where missing or not numeric
+    
+    Validates with a regex up front so bad cells don't cost an exception each.
+    """
+    if column is None:
+        return [None] * len(rows)
+    values = [float(v) if v is not None and _NUMBER_RE.match(v) else None for v in (row[column] for row in rows)]
+    return [int(v) if v is not None and math.isfinite(v) else None for v in values]
+
+
+def _read_rows(file_content: str, columns: Optional[List[str]] = None) -> Tuple[List[str], List[dict]]:
+    """Header and rows of a CSV string; missing cells become None
+    
+    When ``columns`` is given, rows only carry those columns.
+    """
+    reader = csv.DictReader(io.StringIO(file_content))
+    header = reader.fieldnames or []
+    keep = columns if columns is not None else header
+    rows = [{col: _cell(row.get(col)) for col in keep} for row in reader]
+    return header, rows
+
 
 def parse_time_window(time_str: str) -> Tuple[time, time]:
     """Parse time window string like '08:00-12:00' into time objects"""
@@ -30,50 +80,86 @@ def parse_time(time_str: str) -> time:
         raise ValueError(f"Invalid time format: {time_str}")
 
 
-def parse_stops_csv(file_content: str, auto_enrich: bool = True) -> List[Stop]:
+@lru_cache(maxsize=1)
+def _get_nlp() -> NaturalLanguageProcessor:
+    """Shared enrichment processor, built on first use instead of once per upload"""
+    return NaturalLanguageProcessor()
+
+
+async def parse_stops_csv(file_content: str, auto_enrich: bool = True) -> List[Stop]:
     """Enhanced stops CSV parser with AI data enrichment"""
-    nlp = NaturalLanguageProcessor() if auto_enrich else None
+    nlp = _get_nlp() if auto_enrich else None
     
     try:
-        df = pd.read_csv(pd.io.common.StringIO(file_content))
+        # Sniff the header first so only mapped columns are kept
+        header = next(csv.reader(io.StringIO(file_content)), [])
         
         # Flexible column detection - handle various naming conventions
-        column_mapping = _detect_column_mapping(df.columns.tolist())
+        column_mapping = _detect_column_mapping(header)
         logger.info(f"Detected column mapping: {column_mapping}")
         
         # Validate required columns
         if 'address' not in column_mapping:
             raise ValueError("Address column is required but not found")
         
+        # Keep only the mapped columns
+        _, rows = _read_rows(file_content, list(dict.fromkeys(column_mapping.values())))
+        
         stops = []
         enrichment_stats = {"enriched": 0, "warnings": []}
         
-        for idx, row in df.iterrows():
+        # Numeric columns are parsed in bulk before the row loops
+        stop_ids = _int_column(rows, column_mapping.get('stop_id'))
+        pallet_counts = _int_column(rows, column_mapping.get('pallets'))
+        
+        # Column names resolved once, not per row
+        address_col = column_mapping['address']
+        time_window_col = column_mapping.get('time_window')
+        pallets_col = column_mapping.get('pallets')
+        special_col = column_mapping.get('special')
+        
+        # Pass 1: ids, addresses and raw cells, so enrichment can go out as one batch
+        parsed = []
+        for idx, row in enumerate(rows):
             try:
-                # Extract data with fallbacks
-                stop_id = _extract_stop_id(row, column_mapping, idx)
-                address = row[column_mapping['address']].strip()
-                
-                # AI-powered data enrichment
-                enriched_data = {}
-                if auto_enrich and nlp:
-                    enriched_data = nlp.enrich_stop_data(address)
-                    if enriched_data.get("ai_reasoning"):
-                        enrichment_stats["enriched"] += 1
+                stop_id = _extract_stop_id(stop_ids[idx], idx)
+                address = row[address_col].strip()
+                parsed.append((
+                    idx, stop_id, address,
+                    row[time_window_col] if time_window_col else None,
+                    row[pallets_col] if pallets_col else None,
+                    row[special_col] if special_col else None,
+                ))
+            except Exception as e:
+                warning = f"Row {idx + 1}: {str(e)}"
+                enrichment_stats["warnings"].append(warning)
+                logger.warning(warning)
+        
+        # AI-powered data enrichment
+        if auto_enrich and nlp:
+            enriched_list = await nlp.enrich_stop_data_batch([entry[2] for entry in parsed])
+        else:
+            enriched_list = [{}] * len(parsed)
+        
+        # Pass 2: build stops from the row and its enrichment
+        for (idx, stop_id, address, time_window, pallets_raw, special), enriched_data in zip(parsed, enriched_list):
+            try:
+                if enriched_data.get("ai_reasoning"):
+                    enrichment_stats["enriched"] += 1
                 
                 # Parse time window with AI fallback
                 time_start, time_end = _parse_time_window_flexible(
-                    row, column_mapping, enriched_data
+                    time_window, enriched_data, address
                 )
                 
                 # Parse pallets with AI estimation
                 pallets = _parse_pallets_flexible(
-                    row, column_mapping, enriched_data
+                    pallets_raw, pallet_counts[idx], enriched_data, address
                 )
                 
                 # Parse special constraints with AI inference
                 special_constraint = _parse_constraint_flexible(
-                    row, column_mapping, enriched_data, address
+                    special, enriched_data, address
                 )
                 
                 stop = Stop(
@@ -109,60 +195,35 @@ def parse_stops_csv(file_content: str, auto_enrich: bool = True) -> List[Stop]:
 
 def _detect_column_mapping(columns: List[str]) -> dict:
     """Detect column mappings for flexible CSV parsing"""
-    columns_lower = [col.lower() for col in columns]
-    mapping = {}
-    
-    # Address detection
-    for i, col in enumerate(columns_lower):
-        if any(keyword in col for keyword in ['address', 'addr', 'location', 'destination']):
-            mapping['address'] = columns[i]
-            break
-    
-    # Stop ID detection
-    for i, col in enumerate(columns_lower):
-        if any(keyword in col for keyword in ['stopid', 'stop_id', 'id', 'stop']):
-            mapping['stop_id'] = columns[i]
-            break
-    
-    # Time window detection
-    for i, col in enumerate(columns_lower):
-        if any(keyword in col for keyword in ['timewindow', 'time_window', 'window', 'time']):
-            mapping['time_window'] = columns[i]
-            break
-    
-    # Pallets detection
-    for i, col in enumerate(columns_lower):
-        if any(keyword in col for keyword in ['pallets', 'pallet', 'quantity', 'qty', 'units']):
-            mapping['pallets'] = columns[i]
-            break
+    found = {}
     
-    # Special constraints detection
-    for i, col in enumerate(columns_lower):
-        if any(keyword in col for keyword in ['special', 'constraint', 'type', 'handling']):
-            mapping['special'] = columns[i]
+    # One pass over the header; each category keeps its first matching column
+    for col in columns:
+        col_lower = col.lower()
+        for category, keywords in _CATEGORY_KEYWORDS.items():
+            if category not in found and any(keyword in col_lower for keyword in keywords):
+                found[category] = col
+        if len(found) == len(_CATEGORY_KEYWORDS):
             break
     
-    return mapping
+    return {category: found[category] for category in _CATEGORY_KEYWORDS if category in found}
 
 
-def _extract_stop_id(row, column_mapping: dict, fallback_idx: int) -> int:
-    """Extract stop ID with fallback to row index"""
-    if 'stop_id' in column_mapping:
-        try:
-            return int(row[column_mapping['stop_id']])
-        except (ValueError, TypeError):
-            pass
+def _extract_stop_id(stop_id: Optional[int], fallback_idx: int) -> int:
+    """Parsed stop ID with fallback to row index"""
+    if stop_id is not None:
+        return stop_id
     
     return fallback_idx + 1
 
 
-def _parse_time_window_flexible(row, column_mapping: dict, enriched_data: dict) -> Tuple[time, time]:
-    """Parse time window with AI enrichment fallback"""
-    if 'time_window' in column_mapping and pd.notna(row[column_mapping['time_window']]):
+def _parse_time_window_flexible(time_window: Optional[str], enriched_data: dict, address: str) -> Tuple[time, time]:
+    """Parse time window cell with AI enrichment fallback"""
+    if time_window is not None:
         try:
-            return parse_time_window(str(row[column_mapping['time_window']]))
+            return parse_time_window(time_window)
         except ValueError:
-            logger.warning(f"Invalid time window format: {row[column_mapping['time_window']]}")
+            logger.warning(f"Invalid time window format: {time_window}")
     
     # Use AI enriched time window
     if "suggested_time_window" in enriched_data:
@@ -172,17 +233,16 @@ def _parse_time_window_flexible(row, column_mapping: dict, enriched_data: dict)
             pass
     
     # Default time window
-    logger.info(f"Using default time window 08:00-17:00 for address: {row[column_mapping['address']]}")
+    logger.info(f"Using default time window 08:00-17:00 for address: {address}")
     return time(8, 0), time(17, 0)
 
 
-def _parse_pallets_flexible(row, column_mapping: dict, enriched_data: dict) -> int:
-    """Parse pallets with AI estimation fallback"""
-    if 'pallets' in column_mapping and pd.notna(row[column_mapping['pallets']]):
-        try:
-            return int(float(row[column_mapping['pallets']]))
-        except (ValueError, TypeError):
-            logger.warning(f"Invalid pallets value: {row[column_mapping['pallets']]}")
+def _parse_pallets_flexible(raw: Optional[str], pallets: Optional[int], enriched_data: dict, address: str) -> int:
+    """Pallets from the bulk-parsed column, with AI estimation fallback"""
+    if pallets is not None:
+        return pallets
+    if raw is not None:
+        logger.warning(f"Invalid pallets value: {raw}")
     
     # Use AI estimated pallets
     if "estimated_pallets" in enriched_data:
@@ -190,14 +250,14 @@ def _parse_pallets_flexible(row, column_mapping: dict, enriched_data: dict) -> i
         return enriched_data["estimated_pallets"]
     
     # Default pallet count
-    logger.info(f"Using default 3 pallets for address: {row[column_mapping['address']]}")
+    logger.info(f"Using default 3 pallets for address: {address}")
     return 3
 
 
-def _parse_constraint_flexible(row, column_mapping: dict, enriched_data: dict, address: str) -> SpecialConstraint:
-    """Parse special constraints with AI inference"""
-    if 'special' in column_mapping and pd.notna(row[column_mapping['special']]):
-        constraint_str = str(row[column_mapping['special']]).strip()
+def _parse_constraint_flexible(special: Optional[str], enriched_data: dict, address: str) -> SpecialConstraint:
+    """Parse special constraint cell with AI inference"""
+    if special is not None:
+        constraint_str = special.strip()
         try:
             return SpecialConstraint(constraint_str)
         except ValueError:
@@ -218,15 +278,14 @@ def _parse_constraint_flexible(row, column_mapping: dict, enriched_data: dict, a
 def parse_trucks_csv(file_content: str) -> List[Truck]:
     """Parse trucks CSV content into Truck objects"""
     try:
-        df = pd.read_csv(pd.io.common.StringIO(file_content))
-        
         required_columns = ['TruckID', 'Depot', 'MaxPallets', 'Type', 'ShiftStart', 'ShiftEnd']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        header, rows = _read_rows(file_content, required_columns)
+        missing_columns = [col for col in required_columns if col not in header]
         if missing_columns:
             raise ValueError(f"Missing required columns: {missing_columns}")
         
         trucks = []
-        for _, row in df.iterrows():
+        for row in rows:
             truck_type = row['Type'].strip()
             if truck_type not in [e.value for e in TruckType]:
                 logger.warning(f"Unknown truck type '{truck_type}', defaulting to DRY")
@@ -237,7 +296,7 @@ def parse_trucks_csv(file_content: str) -> List[Truck]:
             truck = Truck(
                 truck_id=str(row['TruckID']).strip(),
                 depot_address=row['Depot'].strip(),
-                max_pallets=int(row['MaxPallets']),
+                max_pallets=int(float(row['MaxPallets'])),
                 truck_type=truck_type,
                 shift_start=parse_time(row['ShiftStart']),
                 shift_end=parse_time(row['ShiftEnd'])
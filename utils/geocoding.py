@@ -1,62 +1,606 @@
 from geopy.geocoders import Nominatim
+from geopy.adapters import AioHTTPAdapter, RequestsAdapter
 from geopy.distance import geodesic
-from typing import Tuple, Optional, Dict
+from geopy.extra.rate_limiter import AsyncRateLimiter, RateLimiter
+from typing import Tuple, Optional, Dict, List, Union
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
+import re
+import sqlite3
+import threading
 import time
 from functools import lru_cache
+from math import degrees, radians, sin, cos, asin, sqrt
+
+import httpx
+import numpy as np
+from scipy.spatial import cKDTree
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is an optional accelerator
+    njit = None
 
 logger = logging.getLogger(__name__)
 
+NOMINATIM_USER_AGENT = "flowlogic_routeai_v1"
+NOMINATIM_MIN_INTERVAL = 1.0  # seconds between Nominatim requests (usage policy: at most 1/s)
+EARTH_RADIUS_MILES = 3958.8
+
+# Persistent geocode cache in the user cache directory (not the working directory);
+# set GEOCODE_CACHE_PATH to an empty string to keep it in memory only
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "flowlogic", "geocache.db"
+))
+# Disk entries older than this are ignored and purged, so moved or corrected addresses refresh
+GEOCODE_CACHE_TTL_DAYS = float(os.getenv("GEOCODE_CACHE_TTL_DAYS", "30"))
+
+# From this many locations the compiled sklearn kernel beats NumPy broadcasting
+SKLEARN_MIN_LOCATIONS = 200
+
+# Below this many locations the parallel kernel's thread dispatch costs more than the math
+JIT_PARALLEL_MIN_LOCATIONS = 32
+
+# Bump when the cache key or table layout changes; older cache files are rebuilt
+GEOCODE_CACHE_SCHEMA = 2
+
+
+_KEY_STRIP_RE = re.compile(r"[^\w\s,]")
+_KEY_SPACE_RE = re.compile(r"\s+")
+
+
+def _cache_key(address: str) -> str:
+    """Cache key for an address: case, punctuation (except commas) and extra whitespace don't matter"""
+    return _KEY_SPACE_RE.sub(" ", _KEY_STRIP_RE.sub("", address)).strip().lower()
+
+
+def _coords(location) -> Optional[Tuple[float, float]]:
+    """(lat, lon) of a geopy Location, or None"""
+    return (location.latitude, location.longitude) if location else None
+
+
+@lru_cache(maxsize=32)
+def _triu_pairs(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Upper-triangle (i, j) index arrays for an n x n matrix, built once per n"""
+    i, j = np.triu_indices(n, 1)
+    i.flags.writeable = False
+    j.flags.writeable = False
+    return i, j
+
+
+def _haversine_matrix_np(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """All-pairs haversine distances in miles with NumPy (inputs in radians)"""
+    cos_lat = np.cos(lat)
+    
+    # Distances are symmetric: evaluate each pair once and mirror it
+    i, j = _triu_pairs(len(lat))
+    a = np.sin((lat[i] - lat[j]) / 2) ** 2 + cos_lat[i] * cos_lat[j] * np.sin((lon[i] - lon[j]) / 2) ** 2
+    np.arcsin(np.sqrt(a, out=a), out=a)
+    a *= 2 * EARTH_RADIUS_MILES
+    
+    D = np.zeros((len(lat), len(lat)))
+    D[i, j] = a
+    D[j, i] = a
+    return D
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_matrix_jit(lat, lon, cos_lat, out, R):
+        """Fill ``out`` with all-pairs haversine distances (inputs in radians), rows in parallel
+        
+        Only the upper triangle is evaluated; each value is mirrored below the diagonal.
+        ``cos_lat`` is precomputed so the inner loop has no cos calls.
+        """
+        n = lat.shape[0]
+        for i in prange(n):
+            out[i, i] = 0.0
+            ci = cos_lat[i]
+            for j in range(i + 1, n):
+                a = sin((lat[j] - lat[i]) / 2) ** 2 + ci * cos_lat[j] * sin((lon[j] - lon[i]) / 2) ** 2
+                d = 2 * R * asin(sqrt(a))
+                out[i, j] = d
+                out[j, i] = d
+    
+    # Same kernel compiled without threading, for the small per-route matrices
+    _haversine_matrix_jit_serial = njit(fastmath=True, cache=True)(_haversine_matrix_jit.py_func)
+else:
+    _haversine_matrix_jit = _haversine_matrix_jit_serial = None
+
+
+def _haversine_matrix(lat: np.ndarray, lon: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """All-pairs haversine distances in miles (inputs in radians), stored as ``dtype``"""
+    if _haversine_matrix_jit is not None:
+        # Fused kernel writes straight into the result, no N x N temporaries
+        # (numba has no float16, so that is narrowed from float32 afterwards)
+        D = np.empty((len(lat), len(lat)), dtype=np.float32 if np.dtype(dtype).itemsize < 4 else dtype)
+        lat = np.ascontiguousarray(lat)
+        kernel = _haversine_matrix_jit if len(lat) >= JIT_PARALLEL_MIN_LOCATIONS else _haversine_matrix_jit_serial
+        kernel(lat, np.ascontiguousarray(lon), np.cos(lat), D, EARTH_RADIUS_MILES)
+        return D.astype(dtype, copy=False)
+    if len(lat) < SKLEARN_MIN_LOCATIONS:
+        return _haversine_matrix_np(lat, lon).astype(dtype, copy=False)
+    # Imported here: sklearn is slow to import and only this fallback uses it
+    from sklearn.metrics.pairwise import haversine_distances
+    D = haversine_distances(np.column_stack((lat, lon)))
+    D *= EARTH_RADIUS_MILES
+    np.fill_diagonal(D, 0.0)
+    return D.astype(dtype, copy=False)
+
+
+@dataclass(slots=True)
+class GeoPoint:
+    """A location in radians with its latitude cosine, so repeated haversines skip the conversions"""
+    lat_rad: float
+    lon_rad: float
+    cos_lat: float
+    
+    @classmethod
+    def from_degrees(cls, lat: float, lon: float) -> "GeoPoint":
+        lat_rad = radians(lat)
+        return cls(lat_rad, radians(lon), cos(lat_rad))
+
+
+def _degrees(point: Union[Tuple[float, float], GeoPoint]) -> Tuple[float, float]:
+    """(lat, lon) in degrees for a tuple or GeoPoint"""
+    if isinstance(point, GeoPoint):
+        return degrees(point.lat_rad), degrees(point.lon_rad)
+    return point
+
+
+def distance(p: GeoPoint, q: GeoPoint) -> float:
+    """Haversine distance in miles between two GeoPoints"""
+    a = sin((q.lat_rad - p.lat_rad) / 2) ** 2 + p.cos_lat * q.cos_lat * sin((q.lon_rad - p.lon_rad) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
+
+
+@dataclass
+class DistanceMatrix:
+    """All-pairs distances in miles: ``D[index[a], index[b]]``, also readable as ``matrix[a, b]``"""
+    ids: List[str]
+    index: Dict[str, int]
+    D: np.ndarray
+    
+    def __getitem__(self, pair: Tuple[str, str]) -> float:
+        a, b = pair
+        return float(self.D[self.index[a], self.index[b]])
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class LazyDistanceMatrix:
+    """Distances in miles computed on first use, for solvers that touch only a few pairs
+    
+    ``matrix[a, b]`` or ``matrix(a, b)`` evaluates one haversine and memoizes it in an
+    LRU of ``cache_size`` pairs (symmetric pairs share an entry). ``to_dense()`` builds
+    the full DistanceMatrix with the vectorized kernels.
+    """
+    
+    def __init__(self, locations: Dict[str, Tuple[float, float]], cache_size: int = 100_000):
+        self.ids = list(locations.keys())
+        self.index = {loc_id: i for i, loc_id in enumerate(self.ids)}
+        self._points = [GeoPoint.from_degrees(lat, lon) for lat, lon in locations.values()]
+        # Per-instance cache, so the matrix doesn't outlive its own references
+        self._pair = lru_cache(maxsize=cache_size)(self._pair_distance)
+    
+    def _pair_distance(self, i: int, j: int) -> float:
+        return distance(self._points[i], self._points[j])
+    
+    def __call__(self, a: str, b: str) -> float:
+        i, j = self.index[a], self.index[b]
+        if i == j:
+            return 0.0
+        return self._pair(i, j) if i < j else self._pair(j, i)
+    
+    def __getitem__(self, pair: Tuple[str, str]) -> float:
+        return self(*pair)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def to_dense(self, dtype=np.float32) -> DistanceMatrix:
+        """Materialize every pair at once"""
+        lat = np.array([p.lat_rad for p in self._points], dtype=np.float64)
+        lon = np.array([p.lon_rad for p in self._points], dtype=np.float64)
+        return DistanceMatrix(list(self.ids), dict(self.index), _haversine_matrix(lat, lon, dtype))
+
+
+class SpatialIndex:
+    """Nearest-location queries through a k-d tree over equirectangular-projected points
+    
+    Points are projected as (R*cos(lat0)*lon, R*lat) around the mean latitude lat0, so
+    queries are O(log N) instead of a scan. The projection is off by well under 0.5%
+    across a metro region; ``nearest`` re-ranks extra candidates by exact haversine.
+    """
+    
+    def __init__(self, locations: Dict[str, Tuple[float, float]]):
+        self.ids = list(locations.keys())
+        coords = np.radians(np.array(list(locations.values()), dtype=np.float64).reshape(-1, 2))
+        self._lat = coords[:, 0]
+        self._lon = coords[:, 1]
+        self.lat0 = float(self._lat.mean()) if len(self.ids) else 0.0
+        self.tree = cKDTree(self._project(self._lat, self._lon)) if len(self.ids) else None
+    
+    def _project(self, lat, lon) -> np.ndarray:
+        return np.column_stack((EARTH_RADIUS_MILES * cos(self.lat0) * lon, EARTH_RADIUS_MILES * lat))
+    
+    def nearest(self, probe: Tuple[float, float], k: int = 1, refine: bool = True) -> List[Tuple[str, float]]:
+        """Up to ``k`` (id, miles) nearest to ``probe`` (lat, lon in degrees), closest first
+        
+        With ``refine=False`` the distances are the projected (planar) miles.
+        """
+        if self.tree is None or k < 1:
+            return []
+        lat, lon = radians(probe[0]), radians(probe[1])
+        # A few spare candidates absorb ordering errors from the projection
+        n_query = min(len(self.ids), k + 4 if refine else k)
+        dists, idx = self.tree.query(self._project(np.array([lat]), np.array([lon]))[0], k=n_query)
+        dists, idx = np.atleast_1d(dists), np.atleast_1d(idx)
+        
+        if refine:
+            a = (np.sin((self._lat[idx] - lat) / 2) ** 2 +
+                 cos(lat) * np.cos(self._lat[idx]) * np.sin((self._lon[idx] - lon) / 2) ** 2)
+            dists = 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+            order = np.argsort(dists, kind="stable")
+            dists, idx = dists[order], idx[order]
+        
+        return [(self.ids[i], float(d)) for i, d in zip(idx[:k].tolist(), dists[:k].tolist())]
+
+
+def build_spatial_index(locations: Dict[str, Tuple[float, float]]) -> SpatialIndex:
+    """Spatial index over ``locations`` (id -> (lat, lon) in degrees) for nearest queries"""
+    return SpatialIndex(locations)
+
+
+class SlidingWindowLimiter:
+    """Allow at most ``max_calls`` calls in any ``period`` seconds, across threads"""
+    
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a call fits in the window, then record it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                wait = self._calls[0] + self.period - now
+            time.sleep(wait)
+
+
+class GeocoderBackend(ABC):
+    """Provider that resolves a list of addresses, ideally in one request"""
+    
+    name = "base"
+    max_batch_size = 1
+    
+    @abstractmethod
+    def batch(self, addresses: List[str]) -> List[Optional[Tuple[float, float]]]:
+        """Coordinates per address, in order, None where not found; raises on request failure"""
+
+
+class NominatimBackend(GeocoderBackend):
+    """Nominatim has no batch endpoint: one rate-limited request per address"""
+    
+    name = "nominatim"
+    max_batch_size = 1  # one request per address anyway; a failure then loses only that address
+    
+    def __init__(self, geocode):
+        self._geocode = geocode
+    
+    def batch(self, addresses: List[str]) -> List[Optional[Tuple[float, float]]]:
+        results = []
+        for address in addresses:
+            location = self._geocode(address)
+            results.append((location.latitude, location.longitude) if location else None)
+        return results
+
+
+class MapboxBackend(GeocoderBackend):
+    """Mapbox batch geocoding: up to 1000 queries per POST"""
+    
+    name = "mapbox"
+    max_batch_size = 1000
+    url = "https://api.mapbox.com/search/geocode/v6/batch"
+    
+    def __init__(self, access_token: str):
+        self._client = httpx.Client(timeout=30, params={"access_token": access_token})
+    
+    def batch(self, addresses: List[str]) -> List[Optional[Tuple[float, float]]]:
+        response = self._client.post(self.url, json=[{"q": a, "limit": 1} for a in addresses])
+        response.raise_for_status()
+        results = []
+        for item in response.json().get("batch", []):
+            features = item.get("features") or []
+            if features:
+                lon, lat = features[0]["geometry"]["coordinates"][:2]
+                results.append((lat, lon))
+            else:
+                results.append(None)
+        return results
+
+
+class ArcGISBackend(GeocoderBackend):
+    """ArcGIS World Geocoder geocodeAddresses: up to 150 records per POST"""
+    
+    name = "arcgis"
+    max_batch_size = 150
+    url = "https://geocode-api.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses"
+    
+    def __init__(self, api_key: str):
+        self._api_key = api_key
+        self._client = httpx.Client(timeout=30)
+    
+    def batch(self, addresses: List[str]) -> List[Optional[Tuple[float, float]]]:
+        records = [{"attributes": {"OBJECTID": i, "SingleLine": a}} for i, a in enumerate(addresses)]
+        response = self._client.post(self.url, data={
+            "addresses": json.dumps({"records": records}),
+            "f": "json",
+            "token": self._api_key,
+        })
+        response.raise_for_status()
+        results: List[Optional[Tuple[float, float]]] = [None] * len(addresses)
+        # Results come back unordered; ResultID is the OBJECTID we sent
+        for match in response.json().get("locations", []):
+            location = match.get("location") or {}
+            result_id = match.get("attributes", {}).get("ResultID")
+            if match.get("score", 0) > 0 and "x" in location and result_id is not None:
+                results[result_id] = (location["y"], location["x"])
+        return results
+
 
 class GeocodingService:
-    def __init__(self):
-        self.geolocator = Nominatim(user_agent="flowlogic_routeai_v1")
+    def __init__(self, cache_path: Optional[str] = None):
+        # requests.Session under the hood keeps the TCP/TLS connection to Nominatim alive
+        self.geolocator = Nominatim(user_agent=NOMINATIM_USER_AGENT, adapter_factory=RequestsAdapter)
+        # Thread-safe throttle on actual network requests only; cache hits never wait
+        self._geocode = RateLimiter(
+            self.geolocator.geocode,
+            min_delay_seconds=NOMINATIM_MIN_INTERVAL,
+            swallow_exceptions=False
+        )
+        self.backend = self._make_backend()
         self._cache = {}
+        self._db = self._open_disk_cache(GEOCODE_CACHE_PATH if cache_path is None else cache_path)
+        self._db_lock = threading.Lock()
+    
+    def _make_backend(self) -> GeocoderBackend:
+        """Batch geocoding provider from GEOCODER_BACKEND; Nominatim unless another is configured"""
+        backend = os.getenv("GEOCODER_BACKEND", "nominatim").lower()
+        if backend == "mapbox" and os.getenv("MAPBOX_ACCESS_TOKEN"):
+            return MapboxBackend(os.getenv("MAPBOX_ACCESS_TOKEN"))
+        if backend == "arcgis" and os.getenv("ARCGIS_API_KEY"):
+            return ArcGISBackend(os.getenv("ARCGIS_API_KEY"))
+        if backend != "nominatim":
+            logger.warning(f"Geocoder backend '{backend}' is not configured, using Nominatim")
+        return NominatimBackend(self._geocode)
+    
+    def _open_disk_cache(self, path: str) -> Optional[sqlite3.Connection]:
+        """SQLite cache of geocoded addresses that survives restarts; None when disabled or unavailable"""
+        if not path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            if db.execute("PRAGMA user_version").fetchone()[0] != GEOCODE_CACHE_SCHEMA:
+                db.execute("DROP TABLE IF EXISTS geocache")
+                db.execute(f"PRAGMA user_version = {GEOCODE_CACHE_SCHEMA}")
+            # addr is the normalized key; address keeps the first spelling seen, for debugging
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS geocache "
+                "(addr TEXT PRIMARY KEY, address TEXT NOT NULL, "
+                "lat REAL NOT NULL, lon REAL NOT NULL, ts INTEGER NOT NULL)"
+            )
+            db.execute("DELETE FROM geocache WHERE ts < ?", (self._cache_cutoff(),))
+            return db
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Geocode disk cache unavailable at '{path}': {e}")
+            return None
+    
+    @staticmethod
+    def _cache_cutoff() -> int:
+        """Oldest ``ts`` still served from the disk cache"""
+        return int(time.time() - GEOCODE_CACHE_TTL_DAYS * 86400)
+    
+    def _cached(self, key: str) -> Tuple[bool, Optional[Tuple[float, float]]]:
+        """(hit, coords) from memory, then disk; disk hits are promoted to memory"""
+        if key in self._cache:
+            return True, self._cache[key]
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT lat, lon FROM geocache WHERE addr = ? AND ts >= ?", (key, self._cache_cutoff())
+                ).fetchone()
+            if row is not None:
+                self._cache[key] = coords = (row[0], row[1])
+                return True, coords
+        return False, None
+    
+    def _store(self, address: str, key: str,
+               coords: Optional[Tuple[float, float]]) -> Optional[Tuple[float, float]]:
+        """Cache a geocoder answer under ``key`` and return it"""
+        if coords:
+            self._cache[key] = coords
+            if self._db is not None:
+                with self._db_lock:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO geocache (addr, address, lat, lon, ts) VALUES (?, ?, ?, ?, ?)",
+                        (key, address, coords[0], coords[1], int(time.time()))
+                    )
+            logger.info(f"Geocoded '{address}' to {coords}")
+            return coords
+        
+        # Remember misses too (in memory only), so unknown addresses aren't re-requested
+        self._cache[key] = None
+        logger.warning(f"Could not geocode address: {address}")
+        return None
+    
+    def _misses(self, addresses: List[str]) -> List[str]:
+        """Addresses not in the cache, one spelling per cache key"""
+        first = {}
+        for address in addresses:
+            first.setdefault(_cache_key(address), address)
+        return [address for key, address in first.items() if not self._cached(key)[0]]
     
-    @lru_cache(maxsize=1000)
     def geocode_address(self, address: str) -> Optional[Tuple[float, float]]:
         """Convert address to lat/lon coordinates"""
         try:
-            if address in self._cache:
-                return self._cache[address]
-            
-            time.sleep(0.5)  # Rate limiting for Nominatim
-            location = self.geolocator.geocode(address)
-            
-            if location:
-                coords = (location.latitude, location.longitude)
-                self._cache[address] = coords
-                logger.info(f"Geocoded '{address}' to {coords}")
+            key = _cache_key(address)
+            hit, coords = self._cached(key)
+            if hit:
                 return coords
-            else:
-                logger.warning(f"Could not geocode address: {address}")
-                return None
+            
+            return self._store(address, key, _coords(self._geocode(address)))
+                
+        except Exception as e:
+            logger.error(f"Geocoding error for '{address}': {e}")
+            return None
+    
+    def geocode_batch(self, addresses: List[str], size: int = 50) -> List[Optional[Tuple[float, float]]]:
+        """Geocode many addresses through the configured backend, ``size`` per request
+        
+        Cached and duplicate addresses never go out. A failed request leaves its
+        addresses uncached (None here) so they're retried next time.
+        """
+        misses = self._misses(addresses)
+        size = max(1, min(size, self.backend.max_batch_size))
+        
+        for start in range(0, len(misses), size):
+            chunk = misses[start:start + size]
+            try:
+                results = self.backend.batch(chunk)
+            except Exception as e:
+                logger.error(f"Batch geocoding of {len(chunk)} addresses via {self.backend.name} failed: {e}")
+                continue
+            for address, coords in zip(chunk, results):
+                self._store(address, _cache_key(address), coords)
+        
+        return [self._cache.get(_cache_key(a)) for a in addresses]
+    
+    def geocode_many_threaded(self, addresses: List[str], max_inflight: int = 4,
+                              min_delay: float = NOMINATIM_MIN_INTERVAL) -> List[Optional[Tuple[float, float]]]:
+        """Geocode cache misses on ``max_inflight`` threads, one result per address in order
+        
+        Opt-in for self-hosted Nominatim or other endpoints that allow bursts: up to
+        ``max_inflight`` requests go out per ``min_delay`` seconds (sliding window), so
+        K addresses take about K * min_delay / max_inflight seconds. The public
+        Nominatim policy needs the default geocode_address path instead.
+        """
+        misses = self._misses(addresses)
+        limiter = SlidingWindowLimiter(max_inflight, min_delay)
+        # geopy's requests session isn't thread-safe: one geocoder per worker thread
+        local = threading.local()
+        
+        def geocode(address: str):
+            if not hasattr(local, "geolocator"):
+                local.geolocator = Nominatim(user_agent=NOMINATIM_USER_AGENT, adapter_factory=RequestsAdapter)
+            try:
+                limiter.acquire()
+                self._store(address, _cache_key(address), _coords(local.geolocator.geocode(address)))
+            except Exception as e:
+                logger.error(f"Geocoding error for '{address}': {e}")
+        
+        if misses:
+            with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+                list(executor.map(geocode, misses))
+        
+        return [self._cache.get(_cache_key(a)) for a in addresses]
+    
+    async def geocode_many(self, addresses: List[str]) -> List[Optional[Tuple[float, float]]]:
+        """Geocode many addresses concurrently, one result per address in order
+        
+        Cache misses are requested together over one aiohttp session, still spaced by
+        NOMINATIM_MIN_INTERVAL, so waiting on slow responses overlaps. Without aiohttp
+        installed, the sync path runs in threads behind the shared rate limiter.
+        """
+        misses = self._misses(addresses)
+        
+        if misses and AioHTTPAdapter.is_available:
+            async with Nominatim(user_agent=NOMINATIM_USER_AGENT, adapter_factory=AioHTTPAdapter) as geolocator:
+                geocode = AsyncRateLimiter(
+                    geolocator.geocode,
+                    min_delay_seconds=NOMINATIM_MIN_INTERVAL,
+                    swallow_exceptions=False
+                )
+                await asyncio.gather(*(self._geocode_one(geocode, a) for a in misses))
+        elif misses:
+            await asyncio.gather(*(asyncio.to_thread(self.geocode_address, a) for a in misses))
+        
+        return [self._cache.get(_cache_key(a)) for a in addresses]
+    
+    async def _geocode_one(self, geocode, address: str) -> Optional[Tuple[float, float]]:
+        """One rate-limited async lookup; results go to the shared caches"""
+        try:
+            return self._store(address, _cache_key(address), _coords(await geocode(address)))
                 
         except Exception as e:
             logger.error(f"Geocoding error for '{address}': {e}")
             return None
     
-    def calculate_distance(self, coord1: Tuple[float, float], coord2: Tuple[float, float]) -> float:
-        """Calculate distance in miles between two coordinates"""
+    def calculate_distance(self, coord1: Union[Tuple[float, float], GeoPoint],
+                           coord2: Union[Tuple[float, float], GeoPoint], precise: bool = False) -> float:
+        """Calculate distance in miles between two coordinates
+        
+        Haversine by default, matching the distance matrix; ``precise=True`` uses the
+        ellipsoidal geodesic instead (~0.5% closer, far slower). Pass GeoPoints for
+        coordinates used repeatedly (e.g. the depot) to skip the per-call conversion.
+        """
         try:
-            return geodesic(coord1, coord2).miles
+            if precise:
+                return geodesic(_degrees(coord1), _degrees(coord2)).miles
+            if isinstance(coord1, GeoPoint):
+                lat1, lon1, cos1 = coord1.lat_rad, coord1.lon_rad, coord1.cos_lat
+            else:
+                lat1, lon1 = radians(coord1[0]), radians(coord1[1])
+                cos1 = cos(lat1)
+            if isinstance(coord2, GeoPoint):
+                lat2, lon2, cos2 = coord2.lat_rad, coord2.lon_rad, coord2.cos_lat
+            else:
+                lat2, lon2 = radians(coord2[0]), radians(coord2[1])
+                cos2 = cos(lat2)
+            a = sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lon2 - lon1) / 2) ** 2
+            return 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
         except Exception as e:
             logger.error(f"Distance calculation error: {e}")
             return 0.0
     
-    def create_distance_matrix(self, locations: Dict[str, Tuple[float, float]]) -> Dict[Tuple[str, str], float]:
-        """Create a distance matrix for all location pairs"""
-        matrix = {}
+    def lazy_distance_matrix(self, locations: Dict[str, Tuple[float, float]],
+                             cache_size: int = 100_000) -> LazyDistanceMatrix:
+        """Distance matrix that computes (and caches) pairs only when they're read"""
+        return LazyDistanceMatrix(locations, cache_size)
+    
+    def create_distance_matrix(self, locations: Dict[str, Tuple[float, float]],
+                               dtype=np.float32) -> DistanceMatrix:
+        """Create a distance matrix for all location pairs (haversine miles)
+        
+        Stored as float32 by default: ~5 m resolution is plenty for routing and halves
+        the memory traffic of scans over ``D``. Pass ``dtype=np.float64`` for full
+        precision or ``np.float16`` when only the ranking matters.
+        """
         location_ids = list(locations.keys())
+        coords = np.radians(np.array(list(locations.values()), dtype=np.float64).reshape(-1, 2))
+        D = _haversine_matrix(coords[:, 0], coords[:, 1], dtype)
         
-        for i, loc1_id in enumerate(location_ids):
-            for j, loc2_id in enumerate(location_ids):
-                if i != j:
-                    coord1 = locations[loc1_id]
-                    coord2 = locations[loc2_id]
-                    distance = self.calculate_distance(coord1, coord2)
-                    matrix[(loc1_id, loc2_id)] = distance
-                else:
-                    matrix[(loc1_id, loc2_id)] = 0.0
-        
-        return matrix
\ No newline at end of file
+        return DistanceMatrix(location_ids, {loc_id: i for i, loc_id in enumerate(location_ids)}, D)
+
+
+@lru_cache(maxsize=1)
+def get_geocoding_service() -> GeocodingService:
+    """Process-wide service, so its HTTP connection and address cache are shared"""
+    return GeocodingService()